@@ -1,13 +1,63 @@
-from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
-from tenacity import Retrying, stop_after_attempt, wait_fixed, retry_if_exception_type
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from tenacity import Retrying, AsyncRetrying, stop_after_attempt, wait_fixed, retry_if_exception_type
+
+from ai_services.client import get_openai_client, get_async_openai_client
 from singleton import singleton
 
+# 不以空格分词的语言（verbose_json 中 language 为语言名，请求参数中为 ISO 代码），分段文本直接拼接
+UNSPACED_LANGUAGES = {"zh", "chinese"}
+# 不知道语言时按字符判断：汉字、假名与全角标点两侧不加空格
+_UNSPACED_CHARS = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u4e00-\u9fff\uff00-\uffef]")
+
+
+def join_texts(texts: List[str], language: Optional[str] = None) -> str:
+    # 拼接转写片段：中文不加空格（否则会在字之间插入空格，破坏 BM25 的字二元组，也污染嵌入文本），其他语言以空格分隔
+    texts = [text.strip() for text in texts if text and text.strip()]
+    if (language or "").lower() in UNSPACED_LANGUAGES:
+        return "".join(texts)
+    joined = texts[0] if texts else ""
+    for text in texts[1:]:
+        unspaced = _UNSPACED_CHARS.match(joined[-1]) or _UNSPACED_CHARS.match(text[0])
+        joined += text if unspaced else f" {text}"
+    return joined
+
+
+def merge_transcriptions(parts: List[Tuple[dict, float]]) -> dict:
+    # 合并分段转写结果 (verbose_json, 起始偏移秒数)，修正各片段的时间戳并重新编号
+    if len(parts) == 1 and parts[0][1] == 0:
+        return parts[0][0]
+    segments = []
+    texts = []
+    duration = 0.0
+    for transcription, offset in parts:
+        text = (transcription.get("text") or "").strip()
+        if text:
+            texts.append(text)
+        for segment in transcription.get("segments") or []:
+            segments.append({
+                **segment,
+                "id": len(segments),
+                "seek": segment.get("seek", 0) + int(offset * 100),
+                "start": segment["start"] + offset,
+                "end": segment["end"] + offset,
+            })
+        duration = max(duration, offset + float(transcription.get("duration") or 0))
+    return {
+        **parts[0][0],
+        "duration": duration,
+        "text": join_texts(texts, parts[0][0].get("language")),
+        "segments": segments,
+    }
+
 
 @singleton
 class OpenAIASRService:
     def __init__(self, model_name: str):
-        self._client = OpenAI()
+        self._client = get_openai_client()
         self._model_name = model_name
 
     def transcribe(self, audio_file: str, **kwargs) -> dict:
@@ -25,6 +75,46 @@ class OpenAIASRService:
             with attempt:
                 return self._transcribe(audio_file, **kwargs)
 
+    async def atranscribe(self, audio_file: str, **kwargs) -> dict:
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=wait_fixed(1),
+            retry=retry_if_exception_type((
+                APIConnectionError,
+                APITimeoutError,
+                InternalServerError,
+                RateLimitError,
+            )),
+        )
+        async for attempt in retrying:
+            with attempt:
+                with open(audio_file, 'rb') as f:
+                    transcription = await get_async_openai_client().audio.transcriptions.create(
+                        model=self._model_name,
+                        file=f,
+                        response_format="verbose_json",
+                        **kwargs
+                    )
+        return transcription.dict()
+
+    def transcribe_chunks(
+            self,
+            chunks: List[Tuple[str, float]],
+            max_workers: int = 4,
+            **kwargs
+    ) -> dict:
+        # 并发转写多个音频分段 (文件路径, 起始偏移秒数)，再拼接为一个完整的转写结果
+        if len(chunks) == 1:
+            audio_file, offset = chunks[0]
+            return merge_transcriptions([(self.transcribe(audio_file, **kwargs), offset)])
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [
+                executor.submit(self.transcribe, audio_file, **kwargs)
+                for audio_file, _ in chunks
+            ]
+            parts = [(future.result(), offset) for future, (_, offset) in zip(futures, chunks)]
+        return merge_transcriptions(parts)
+
     def _transcribe(self, audio_file: str, **kwargs) -> dict:
         with open(audio_file, 'rb') as audio_file:
             transcription = self._client.audio.transcriptions.create(
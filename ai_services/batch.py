@@ -0,0 +1,159 @@
+import json
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Set, Tuple
+
+from ai_services.client import get_openai_client
+
+# 单个批处理任务文件的请求数上限（接口限制为 50000）
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", 50000))
+BATCH_POLL_INTERVAL = float(os.environ.get("BATCH_POLL_INTERVAL", 30))
+# work_dir 中记录已提交、尚未取回结果的任务，中断后再次运行时继续等待这些任务
+BATCH_MANIFEST_FILE = "jobs.json"
+
+FINISHED_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchBackend(ABC):
+    @abstractmethod
+    def submit(self, jsonl_path: str, endpoint: str) -> str:
+        ...
+
+    @abstractmethod
+    def status(self, job_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def results(self, job_id: str) -> List[dict]:
+        ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    def __init__(self, completion_window: str = "24h"):
+        self._client = get_openai_client()
+        self._completion_window = completion_window
+
+    def submit(self, jsonl_path: str, endpoint: str) -> str:
+        with open(jsonl_path, "rb") as f:
+            input_file = self._client.files.create(file=f, purpose="batch")
+        batch = self._client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=endpoint,
+            completion_window=self._completion_window,
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        return self._client.batches.retrieve(job_id).status
+
+    def results(self, job_id: str) -> List[dict]:
+        batch = self._client.batches.retrieve(job_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = self._client.files.content(file_id).text
+                lines.extend(json.loads(line) for line in content.splitlines() if line.strip())
+        return lines
+
+
+class BatchRunner:
+    def __init__(
+            self,
+            backend: BatchBackend,
+            work_dir: str,
+            poll_interval: float = BATCH_POLL_INTERVAL,
+            max_requests: int = BATCH_MAX_REQUESTS,
+    ):
+        self._backend = backend
+        self._work_dir = work_dir
+        self._poll_interval = poll_interval
+        self._max_requests = max_requests
+        os.makedirs(work_dir, exist_ok=True)
+
+    def run(self, endpoint: str, requests: Dict[str, dict]) -> Dict[str, dict]:
+        # requests: custom_id -> 请求体；返回 custom_id -> 响应体，失败的请求不在结果中。
+        # 任务提交后立即写入清单，等待期间（最长 24 小时）崩溃或被中断时，下次运行先继续等待清单中的任务，
+        # 其中已包含的请求不再重复提交、重复付费；custom_id 由请求内容决定，相同的 custom_id 即相同的请求
+        job_ids, covered = self._resume(endpoint, requests)
+        items = [(custom_id, body) for custom_id, body in requests.items() if custom_id not in covered]
+        for start in range(0, len(items), self._max_requests):
+            path = os.path.join(
+                self._work_dir,
+                f"{endpoint.strip('/').replace('/', '_')}_{int(time.time())}_{uuid.uuid4().hex[:8]}_{start}.jsonl"
+            )
+            with open(path, "w", encoding="utf-8") as f:
+                for custom_id, body in items[start:start + self._max_requests]:
+                    f.write(json.dumps({
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": endpoint,
+                        "body": body,
+                    }, ensure_ascii=False) + "\n")
+            job_id = self._backend.submit(path, endpoint)
+            self._save_manifest(self._load_manifest() + [
+                {"job_id": job_id, "endpoint": endpoint, "input": os.path.basename(path)}
+            ])
+            print(f"已提交批处理任务 {job_id}（{min(self._max_requests, len(items) - start)} 个请求）")
+            job_ids.append(job_id)
+
+        responses = {}
+        for job_id in job_ids:
+            status = self._wait(job_id)
+            # 过期的任务仍可能有部分结果
+            if status not in ("completed", "expired"):
+                print(f"批处理任务 {job_id} 未完成: {status}")
+            else:
+                for line in self._backend.results(job_id):
+                    response = line.get("response")
+                    if line.get("custom_id") not in requests:
+                        continue
+                    if response and response.get("status_code") == 200:
+                        responses[line["custom_id"]] = response["body"]
+                    else:
+                        print(f"批处理请求失败 {line.get('custom_id')}: {line.get('error') or response}")
+            self._save_manifest([job for job in self._load_manifest() if job["job_id"] != job_id])
+        return responses
+
+    def _resume(self, endpoint: str, requests: Dict[str, dict]) -> Tuple[List[str], Set[str]]:
+        # 清单中同一接口、包含本次请求的任务继续等待，返回这些任务与其中的 custom_id；
+        # 与本次请求无关的任务（其结果已不再需要）从清单中移除
+        resumed, covered, kept = [], set(), []
+        for job in self._load_manifest():
+            if job["endpoint"] == endpoint:
+                ids = self._input_ids(job["input"])
+                if not any(custom_id in requests for custom_id in ids):
+                    continue
+                print(f"继续等待上次提交的批处理任务 {job['job_id']}")
+                resumed.append(job["job_id"])
+                covered.update(ids)
+            kept.append(job)
+        self._save_manifest(kept)
+        return resumed, covered
+
+    def _input_ids(self, name: str) -> List[str]:
+        path = os.path.join(self._work_dir, name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line)["custom_id"] for line in f if line.strip()]
+
+    def _load_manifest(self) -> List[dict]:
+        path = os.path.join(self._work_dir, BATCH_MANIFEST_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_manifest(self, jobs: List[dict]):
+        path = os.path.join(self._work_dir, BATCH_MANIFEST_FILE)
+        temp_path = f"{path}.part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def _wait(self, job_id: str) -> str:
+        while (status := self._backend.status(job_id)) not in FINISHED_STATUSES:
+            time.sleep(self._poll_interval)
+        return status
@@ -1,21 +1,115 @@
-from typing import Any
+import bisect
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+import numpy as np
 
 from singleton import singleton
 
+# 内存层最多保留的向量数，超出后按 LRU 淘汰
+EMBEDDING_CACHE_SIZE = int(os.environ.get("EMBEDDING_CACHE_SIZE", 10000))
+# 检索结果缓存的条数上限与有效期（秒）
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 3600))
+
+
+def _default_embedding_cache_path() -> Optional[str]:
+    if path := os.environ.get("EMBEDDING_CACHE_PATH"):
+        return path
+    working_dir = os.environ.get("WORKING_DIR")
+    if not working_dir or not os.path.exists(working_dir):
+        return None
+    return os.path.join(working_dir, "embedding_cache.sqlite")
+
 
 @singleton
 class EmbeddingCache:
-    def __init__(self):
-        self._cache = {}
+    # 两级缓存：有上限的内存 LRU + 磁盘上的 SQLite（向量按 float32 打包存储），
+    # 磁盘层在 update_videos.py 与 webui.py 之间共享，重启后仍然有效
+    def __init__(self, path: Optional[str] = None, max_size: int = EMBEDDING_CACHE_SIZE):
+        self._memory = OrderedDict()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._path = path or _default_embedding_cache_path()
+        self._db = None
+        if self._path:
+            self._db = sqlite3.connect(self._path, timeout=30, check_same_thread=False)
+            # WAL 模式允许一个进程写入的同时其他进程读取
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
 
-    def get(self, model: str, key: str) -> Any:
-        return self._cache.get(f"{model}_{key}", None)
+    @staticmethod
+    def make_key(model: str, key: str, dimensions: Optional[int] = None) -> str:
+        return hashlib.sha256(f"{model}\x1f{dimensions}\x1f{key}".encode("utf-8")).hexdigest()
 
-    def set(self, model: str, key: str, value: Any):
-        self._cache[f"{model}_{key}"] = value
+    def _remember(self, cache_key: str, vector: np.ndarray):
+        self._memory[cache_key] = vector
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self._max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, model: str, key: str, dimensions: Optional[int] = None) -> Optional[np.ndarray]:
+        return self.get_many(model, [key], dimensions)[0]
+
+    def get_many(self, model: str, keys: List[str], dimensions: Optional[int] = None) -> List[Optional[np.ndarray]]:
+        cache_keys = [self.make_key(model, key, dimensions) for key in keys]
+        results = [None] * len(keys)
+        missing = {}
+        with self._lock:
+            for i, cache_key in enumerate(cache_keys):
+                if (vector := self._memory.get(cache_key)) is not None:
+                    self._memory.move_to_end(cache_key)
+                    results[i] = vector
+                else:
+                    missing.setdefault(cache_key, []).append(i)
+            if not missing or self._db is None:
+                return results
+            found = {}
+            pending = list(missing)
+            # SQLite 单条语句的参数个数有限，分批查询
+            for start in range(0, len(pending), 500):
+                batch = pending[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for cache_key, blob in rows:
+                    found[cache_key] = np.frombuffer(blob, dtype=np.float32)
+            for cache_key, vector in found.items():
+                self._remember(cache_key, vector)
+                for i in missing[cache_key]:
+                    results[i] = vector
+        return results
+
+    def set(self, model: str, key: str, value: Any, dimensions: Optional[int] = None):
+        self.set_many(model, [key], [value], dimensions)
+
+    def set_many(self, model: str, keys: List[str], values: List[Any], dimensions: Optional[int] = None):
+        rows = []
+        with self._lock:
+            for key, value in zip(keys, values):
+                cache_key = self.make_key(model, key, dimensions)
+                vector = np.asarray(value, dtype=np.float32)
+                self._remember(cache_key, vector)
+                rows.append((cache_key, vector.tobytes()))
+            if self._db is not None and rows:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                self._db.commit()
 
     def clear(self):
-        self._cache.clear()
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
 
 
 @singleton
@@ -31,3 +125,79 @@ class MiscCache:
 
     def clear(self):
         self._cache.clear()
+
+
+class RankedResults:
+    # 一次检索的完整排序结果；按相似度降序另存一份分数，阈值过滤用二分查找
+    def __init__(self, results: List[dict]):
+        self.results = results
+        self._order = sorted(range(len(results)), key=lambda i: -results[i]['score'])
+        self._neg_scores = [-results[i]['score'] for i in self._order]
+        # 排序本身就是按相似度降序时（KEYWORD_FUSION=max），满足阈值的结果就是前缀
+        self._monotone = self._order == list(range(len(results)))
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def select(self, threshold: float, top_k: Optional[int] = None) -> List[dict]:
+        count = bisect.bisect_right(self._neg_scores, -threshold)
+        if self._monotone or count == len(self.results):
+            return self.results[:min(count, top_k if top_k is not None else count)]
+        # 融合排序与相似度不一致时，取出满足阈值的结果再按原排序截断
+        selected = sorted(self._order[:count])[:top_k]
+        return [self.results[i] for i in selected]
+
+
+@singleton
+class ResultCache:
+    # 有上限的 LRU 检索结果缓存，条目超过有效期后失效；每个键只存一份完整排序结果，
+    # 调整相关度阈值或返回条数时不需要重新检索
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL):
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable) -> Optional[RankedResults]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self._ttl:
+                del self._entries[key]
+                self._expired += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, results: List[dict]) -> RankedResults:
+        ranked = RankedResults(results)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), ranked)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return ranked
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "expired": self._expired,
+                "evictions": self._evictions,
+            }
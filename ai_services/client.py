@@ -0,0 +1,45 @@
+import os
+import threading
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+# 所有服务共用一个带连接池的客户端，复用 keep-alive 连接，避免每次请求重新握手
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 120))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 600))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+
+_lock = threading.Lock()
+_client = None
+_async_client = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+def get_openai_client() -> OpenAI:
+    global _client
+    with _lock:
+        if _client is None:
+            _client = OpenAI(http_client=httpx.Client(limits=_limits(), timeout=_timeout()))
+        return _client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    # 异步客户端的连接属于创建它的事件循环，webui 中所有请求都运行在 Gradio 的同一个事件循环上
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            _async_client = AsyncOpenAI(http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()))
+        return _async_client
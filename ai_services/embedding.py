@@ -1,22 +1,230 @@
-from typing import Union, List, Optional
+import asyncio
+import os
+import zlib
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Optional, Tuple
 
-from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError, OpenAIError
-from tenacity import Retrying, stop_after_attempt, wait_fixed, retry_if_exception_type
+import numpy as np
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError, OpenAIError
+from tenacity import Retrying, AsyncRetrying, stop_after_attempt, wait_fixed, retry_if_exception_type
 
 from ai_services.cache import EmbeddingCache
+from ai_services.client import get_openai_client, get_async_openai_client
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
-class OpenAIEmbeddingService:
+# 单次请求的输入条数与 token 数上限（接口限制分别为 2048 条与 300k tokens）
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 512))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get("EMBEDDING_BATCH_TOKENS", 200000))
+# 同时发送的请求数
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 4))
+# 嵌入后端：openai 调用接口；hashing 为进程内的字符 n-gram 哈希向量化，无需网络
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "openai")
+HASHING_NGRAM_RANGE = tuple(int(n) for n in os.environ.get("HASHING_NGRAM_RANGE", "1,3").split(","))
+HASHING_DEFAULT_DIMENSION = 1024
+
+
+def _get_encoder():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+_encoder = _get_encoder()
+
+
+def count_tokens(text: str) -> int:
+    if _encoder is not None:
+        return len(_encoder.encode(text))
+    # 没有 tiktoken 时用 UTF-8 字节数估算：BPE 的每个 token 至少一个字节，因此不会低估
+    return len(text.encode("utf-8"))
+
+
+def make_batches(
+        inputs: List[str],
+        max_size: int = EMBEDDING_BATCH_SIZE,
+        max_tokens: int = EMBEDDING_BATCH_TOKENS,
+) -> List[List[str]]:
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for text in inputs:
+        tokens = count_tokens(text)
+        if batch and (len(batch) >= max_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class EmbeddingService(ABC):
+    # 各后端共用 EmbeddingCache：按 模型名 + 维度 + 文本 缓存，子类只计算缓存中没有的文本
+    model_name: str
+    dimensions: Optional[int]
+
+    @abstractmethod
+    def _embed_uncached(self, inputs: List[str]) -> list:
+        ...
+
+    def _lookup(self, inputs: List[str]) -> Tuple[List[str], list, List[str]]:
+        # 去重后只查询/计算一次，最后按原顺序展开
+        unique = list(dict.fromkeys(inputs))
+        cached = EmbeddingCache().get_many(self.model_name, unique, self.dimensions)
+        uncached = [query for query, vec in zip(unique, cached) if vec is None]
+        return unique, cached, uncached
+
+    def _assemble(self, inputs: List[str], unique: List[str], cached: list, uncached: List[str], embedded: list) -> np.ndarray:
+        if uncached:
+            EmbeddingCache().set_many(self.model_name, uncached, embedded, self.dimensions)
+
+        first = embedded[0] if len(embedded) else next(vec for vec in cached if vec is not None)
+        matrix = np.empty((len(unique), len(first)), dtype=np.float32)
+        new_vecs = iter(embedded)
+        for i, vec in enumerate(cached):
+            matrix[i] = vec if vec is not None else next(new_vecs)
+
+        if len(unique) == len(inputs):
+            return matrix
+        positions = {query: i for i, query in enumerate(unique)}
+        return matrix[[positions[query] for query in inputs]]
+
+    def embed(self, inputs: Union[str, List[str]]) -> np.ndarray:
+        # 返回 (len(inputs), dimensions) 的 float32 矩阵，行顺序与输入一致
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not inputs:
+            return np.zeros((0, self.dimensions or 0), dtype=np.float32)
+        unique, cached, uncached = self._lookup(inputs)
+        embedded = self._embed_uncached(uncached) if uncached else []
+        return self._assemble(inputs, unique, cached, uncached, embedded)
+
+    async def aembed(self, inputs: Union[str, List[str]]) -> np.ndarray:
+        return await asyncio.to_thread(self.embed, inputs)
+
+
+@lru_cache(maxsize=1 << 18)
+def _hash_feature(feature: str, dimensions: int) -> Tuple[int, float]:
+    # 使用稳定的 crc32（内置 hash() 每个进程的结果不同），最高位决定符号以抵消哈希冲突的偏差
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dimensions, 1.0 if h & 0x80000000 else -1.0
+
+
+class HashingEmbeddingService(EmbeddingService):
+    # 字符 n-gram 哈希向量化：对中文关键词这类短文本足够区分，编码在进程内完成，亚毫秒级且可离线使用
+    def __init__(
+            self,
+            dimensions: Optional[int] = None,
+            ngram_range: Tuple[int, int] = HASHING_NGRAM_RANGE,
+    ):
+        self.dimensions = dimensions or HASHING_DEFAULT_DIMENSION
+        self._ngram_range = ngram_range
+        self.model_name = f"hashing-char-{ngram_range[0]}-{ngram_range[1]}"
+
+    def _features(self, text: str) -> List[str]:
+        text = "".join(text.lower().split())
+        low, high = self._ngram_range
+        return [
+            text[i:i + n]
+            for n in range(low, high + 1)
+            for i in range(len(text) - n + 1)
+        ]
+
+    def _embed_uncached(self, inputs: List[str]) -> np.ndarray:
+        rows, columns, values = [], [], []
+        for row, text in enumerate(inputs):
+            for feature in self._features(text):
+                column, sign = _hash_feature(feature, self.dimensions)
+                rows.append(row)
+                columns.append(column)
+                values.append(sign)
+        matrix = np.zeros((len(inputs), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)),
+                  np.asarray(values, dtype=np.float32))
+        # 次线性词频后做 L2 归一化，余弦相似度即点积
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def create_embedding_service(
+        provider: Optional[str] = None,
+        model: Optional[str] = None,
+        dimensions: Optional[int] = None,
+) -> EmbeddingService:
+    provider = provider or EMBEDDING_PROVIDER
+    if provider == "openai":
+        if not model:
+            raise ValueError("请提供嵌入模型")
+        return OpenAIEmbeddingService(model=model, dimensions=dimensions)
+    elif provider == "hashing":
+        return HashingEmbeddingService(dimensions=dimensions)
+    raise ValueError(f"不支持的嵌入后端: {provider}")
+
+
+class OpenAIEmbeddingService(EmbeddingService):
     def __init__(
             self,
             model: str,
             dimensions: Optional[int] = None,
+            max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
     ):
-        self._client = OpenAI()
+        self._client = get_openai_client()
         self._model_name = model
         self._dimensions = dimensions
+        self._max_concurrency = max(1, max_concurrency)
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    @property
+    def dimensions(self) -> Optional[int]:
+        return self._dimensions
+
+    def _embed_uncached(self, inputs: List[str]) -> list:
+        embedded = []
+        batches = make_batches(inputs)
+        if len(batches) == 1:
+            embedded = self._embed_with_retry(batches[0])
+        elif len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=min(self._max_concurrency, len(batches))) as executor:
+                for vecs in executor.map(self._embed_with_retry, batches):
+                    embedded.extend(vecs)
+        return embedded
+
+    async def aembed(self, inputs: Union[str, List[str]]) -> np.ndarray:
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not inputs:
+            return np.zeros((0, self._dimensions or 0), dtype=np.float32)
+
+        # EmbeddingCache 的磁盘层是同步的 SQLite，查询与写入放到线程中执行以免阻塞事件循环
+        unique, cached, uncached = await asyncio.to_thread(self._lookup, inputs)
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def embed_batch(batch: List[str]) -> list:
+            async with semaphore:
+                return await self._aembed_with_retry(batch)
+
+        embedded = []
+        for vecs in await asyncio.gather(*(embed_batch(batch) for batch in make_batches(uncached))):
+            embedded.extend(vecs)
+        return await asyncio.to_thread(self._assemble, inputs, unique, cached, uncached, embedded)
 
-    def embed(self, inputs: Union[str, List[str]]) -> list:
+    def _embed_with_retry(self, inputs: List[str]) -> list:
         retrying = Retrying(
             stop=stop_after_attempt(3),
             wait=wait_fixed(1),
@@ -31,41 +239,44 @@ class OpenAIEmbeddingService:
             with attempt:
                 return self._embed(inputs)
 
-    def _embed(self, inputs: Union[str, List[str]]) -> list:
-        if isinstance(inputs, str):
-            inputs = [inputs]
-        if inputs in [None, []]:
-            return []
-
-        cached = [None for _ in range(len(inputs))]
-        uncached = []
-        for i, query in enumerate(inputs):
-            vec = EmbeddingCache().get(self._model_name, query)
-            if vec is not None:
-                cached[i] = vec
-            else:
-                uncached.append(query)
-        if len(uncached) == 0:
-            return cached
+    async def _aembed_with_retry(self, inputs: List[str]) -> list:
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=wait_fixed(1),
+            retry=retry_if_exception_type((
+                APIConnectionError,
+                APITimeoutError,
+                InternalServerError,
+                RateLimitError,
+            )),
+        )
+        async for attempt in retrying:
+            with attempt:
+                return await self._aembed(inputs)
 
+    def _embed(self, inputs: List[str]) -> list:
         model_kwargs = {
             "dimensions": self._dimensions,
         } if self._dimensions else {}
 
         response = self._client.embeddings.create(
-            input=uncached,
+            input=inputs,
             model=self._model_name,
             **model_kwargs
         )
-        vecs = [item.embedding for item in response.data]
-        for i, query in enumerate(uncached):
-            EmbeddingCache().set(self._model_name, query, vecs[i])
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
-        for i, vec in enumerate(cached):
-            if vec is None:
-                cached[i] = vecs.pop(0)
+    async def _aembed(self, inputs: List[str]) -> list:
+        model_kwargs = {
+            "dimensions": self._dimensions,
+        } if self._dimensions else {}
 
-        return cached
+        response = await get_async_openai_client().embeddings.create(
+            input=inputs,
+            model=self._model_name,
+            **model_kwargs
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
 
 if __name__ == "__main__":
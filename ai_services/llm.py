@@ -1,17 +1,21 @@
-from typing import Union, Iterator, List
+import asyncio
+from typing import Union, Iterator, List, AsyncIterator
 
 import PIL
 from PIL import Image
-from openai import OpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
-from tenacity import Retrying, stop_after_attempt, wait_fixed, retry_if_exception_type
+from openai import APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+from tenacity import Retrying, AsyncRetrying, stop_after_attempt, wait_fixed, retry_if_exception_type
 
-from data_utils.image import image_file_to_base64, image_data_to_base64
+from ai_services.client import get_openai_client, get_async_openai_client
+from data_utils.image import image_to_base64, IMAGE_DETAIL
 
 
 class OpenAILLMService:
-    def __init__(self, model: str):
-        self._client = OpenAI()
+    def __init__(self, model: str, image_detail: str = IMAGE_DETAIL):
+        self._client = get_openai_client()
         self._model_name = model
+        # 图片的 detail（low / high / auto），同时决定预处理时缩放到的尺寸
+        self._image_detail = image_detail
 
     def invoke(
             self,
@@ -53,6 +57,69 @@ class OpenAILLMService:
             with attempt:
                 return self._stream(inputs, images, **kwargs)
 
+    async def ainvoke(
+            self,
+            inputs: Union[str, list],
+            images: list = None,
+            **kwargs
+    ) -> str:
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=wait_fixed(1),
+            retry=retry_if_exception_type((
+                APIConnectionError,
+                APITimeoutError,
+                InternalServerError,
+                RateLimitError,
+            )),
+        )
+        # 图片的旋正、缩放与重新编码是 CPU 密集的，放到线程中执行，重试时复用
+        messages = await asyncio.to_thread(self._format_messages, inputs, images, self._image_detail)
+        async for attempt in retrying:
+            with attempt:
+                completion = await get_async_openai_client().chat.completions.create(
+                    model=self._model_name,
+                    messages=messages,
+                    **kwargs,
+                )
+        return completion.choices[0].message.content
+
+    async def astream(
+            self,
+            inputs: Union[str, list],
+            images: list = None,
+            **kwargs
+    ) -> AsyncIterator[str]:
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=wait_fixed(1),
+            retry=retry_if_exception_type((
+                APIConnectionError,
+                APITimeoutError,
+                InternalServerError,
+                RateLimitError,
+            )),
+        )
+        messages = await asyncio.to_thread(self._format_messages, inputs, images, self._image_detail)
+        # 只对建立流式请求重试，开始输出后不再重试
+        async for attempt in retrying:
+            with attempt:
+                completion = await get_async_openai_client().chat.completions.create(
+                    model=self._model_name,
+                    messages=messages,
+                    stream=True,
+                    timeout=10,
+                    stream_options={"include_usage": True},
+                    **kwargs,
+                )
+        async for chunk in completion:
+            if len(chunk.choices) == 0:
+                break
+            elif chunk.choices[0].finish_reason is not None:
+                pass
+            else:
+                yield chunk.choices[0].delta.content
+
     def _stream(
             self,
             inputs: Union[str, list],
@@ -61,7 +128,7 @@ class OpenAILLMService:
     ) -> Iterator[str]:
         completion = self._client.chat.completions.create(
             model=self._model_name,
-            messages=self._format_messages(inputs, images),
+            messages=self._format_messages(inputs, images, self._image_detail),
             stream=True,
             timeout=10,
             stream_options={"include_usage": True},
@@ -88,7 +155,7 @@ class OpenAILLMService:
     ) -> str:
         completion = self._client.chat.completions.create(
             model=self._model_name,
-            messages=self._format_messages(inputs, images),
+            messages=self._format_messages(inputs, images, self._image_detail),
             **kwargs,
         )
         return completion.choices[0].message.content
@@ -97,23 +164,23 @@ class OpenAILLMService:
     def _format_messages(
             inputs: Union[str, list],
             images: list = None,
+            detail: str = IMAGE_DETAIL,
     ) -> List[dict]:
         if isinstance(inputs, str):
             if not images:
                 return [{"role": "user", "content": inputs}]
             content = [{"type": "text", "text": inputs}]
             for i, img in enumerate(images):
-                if isinstance(img, str):
-                    image_url = image_file_to_base64(img)
-                elif isinstance(img, Image.Image):
-                    image_url = image_data_to_base64(img)
+                if isinstance(img, (str, Image.Image)):
+                    image_url = image_to_base64(img, detail)
                 else:
                     raise ValueError(f"Unsupported image type: {type(img)}")
                 content.append(
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": image_url
+                            "url": image_url,
+                            "detail": detail,
                         }
                     }
                 )
@@ -123,17 +190,16 @@ class OpenAILLMService:
                 return inputs
             content = []
             for i, img in enumerate(images):
-                if isinstance(img, str):
-                    image_url = image_file_to_base64(img)
-                elif isinstance(img, Image.Image):
-                    image_url = image_data_to_base64(img)
+                if isinstance(img, (str, Image.Image)):
+                    image_url = image_to_base64(img, detail)
                 else:
                     raise ValueError(f"Unsupported image type: {type(img)}")
                 content.append(
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": image_url
+                            "url": image_url,
+                            "detail": detail,
                         }
                     }
                 )
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Union
+
+import numpy as np
+
+# 收集并发查询的时间窗口与单批最大条数
+EMBEDDING_MICROBATCH_WAIT_MS = float(os.environ.get("EMBEDDING_MICROBATCH_WAIT_MS", 10))
+EMBEDDING_MICROBATCH_SIZE = int(os.environ.get("EMBEDDING_MICROBATCH_SIZE", 64))
+# 同时进行中的批次数
+EMBEDDING_MICROBATCH_IN_FLIGHT = int(os.environ.get("EMBEDDING_MICROBATCH_IN_FLIGHT", 4))
+
+
+class EmbeddingMicroBatcher:
+    # 把多个用户在短时间内提交的查询合并为一次 embeddings 请求，再把向量分发给各个调用方
+    def __init__(
+            self,
+            embedding_service,
+            max_batch_size: int = EMBEDDING_MICROBATCH_SIZE,
+            max_wait_ms: float = EMBEDDING_MICROBATCH_WAIT_MS,
+            max_in_flight: int = EMBEDDING_MICROBATCH_IN_FLIGHT,
+    ):
+        self._service = embedding_service
+        self._max_batch_size = max(1, max_batch_size)
+        self._max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight))
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._texts = 0
+        self._max_batch = 0
+        self._total_delay = 0.0
+        self._max_delay = 0.0
+        self._worker = threading.Thread(target=self._collect, daemon=True)
+        self._worker.start()
+
+    def submit(self, texts: Union[str, List[str]]) -> Future:
+        if isinstance(texts, str):
+            texts = [texts]
+        future = Future()
+        self._queue.put((list(texts), future, time.monotonic()))
+        return future
+
+    def embed(self, texts: Union[str, List[str]]) -> np.ndarray:
+        return self.submit(texts).result()
+
+    async def aembed(self, texts: Union[str, List[str]]) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _collect(self):
+        while True:
+            requests = [self._queue.get()]
+            size = len(requests[0][0])
+            deadline = time.monotonic() + self._max_wait
+            while size < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request[0])
+            self._executor.submit(self._dispatch, requests)
+
+    def _dispatch(self, requests: list):
+        started = time.monotonic()
+        texts = [text for request_texts, _, _ in requests for text in request_texts]
+        try:
+            vectors = self._service.embed(texts) if texts else np.zeros((0, 0), dtype=np.float32)
+        except BaseException as e:
+            for _, future, _ in requests:
+                future.set_exception(e)
+            return
+        offset = 0
+        for request_texts, future, _ in requests:
+            future.set_result(vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+        delays = [started - enqueued for _, _, enqueued in requests]
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(requests)
+            self._texts += len(texts)
+            self._max_batch = max(self._max_batch, len(texts))
+            self._total_delay += sum(delays)
+            self._max_delay = max(self._max_delay, max(delays))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch_size": self._texts / self._batches if self._batches else 0.0,
+                "max_batch_size": self._max_batch,
+                "avg_queue_delay_ms": self._total_delay / self._requests * 1000 if self._requests else 0.0,
+                "max_queue_delay_ms": self._max_delay * 1000,
+                "queued": self._queue.qsize(),
+            }
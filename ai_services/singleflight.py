@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    # 相同键的并发调用只执行一次，其余调用等待并共享同一个结果（或异常）
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self._executed += 1
+            else:
+                self._coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    async def ado(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        # 异步版本：所有调用方都在同一个事件循环中。计算在单独的任务中进行，每个调用方（包括发起者）都经 shield 等待，
+        # 任何一个调用方被取消都不会取消计算，也不影响其他等待者；全部调用方都取消时计算仍会完成，结果被丢弃
+        task = self._async_calls.get(key)
+        with self._lock:
+            if task is None:
+                self._executed += 1
+            else:
+                self._coalesced += 1
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._async_calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self._async_calls.get(key) is task:
+            del self._async_calls[key]
+        # 标记异常已被读取，没有等待者时不会打印 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls) + len(self._async_calls),
+            }
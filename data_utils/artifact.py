@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+# 键中包含的版本号：改变某一阶段的产物格式时递增，使旧产物失效
+ARTIFACT_VERSION = 1
+
+
+class ArtifactStore:
+    # 按内容寻址保存每个处理阶段的产物（音频、转写、摘要；向量保存在 EmbeddingCache 中），
+    # 键由上游产物的键、模型名与提示词哈希等输入共同决定，任一输入变化都会得到新的键
+    def __init__(self, root: str):
+        self._root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        text = "\x1f".join(str(part) for part in (ARTIFACT_VERSION, *parts))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def path(self, stage: str, key: str, ext: str) -> str:
+        directory = os.path.join(self._root, stage, key[:2])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{key}.{ext}")
+
+    def exists(self, stage: str, key: str, ext: str) -> bool:
+        return os.path.exists(os.path.join(self._root, stage, key[:2], f"{key}.{ext}"))
+
+    def load_json(self, stage: str, key: str) -> Optional[Any]:
+        if not self.exists(stage, key, "json"):
+            return None
+        try:
+            with open(self.path(stage, key, "json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"产物损坏，将重新计算 {stage}/{key}: {e}")
+            return None
+
+    def save_json(self, stage: str, key: str, data: Any):
+        # 先写临时文件再原子替换，中断时不会留下半个产物
+        path = self.path(stage, key, "json")
+        temp_path = f"{path}.part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
@@ -0,0 +1,179 @@
+import os
+import platform
+import re
+import shutil
+import subprocess
+from typing import List, Tuple
+
+# ASR 只需要语音清晰度：16 kHz 单声道、低码率即可，上传体积远小于原始音轨
+ASR_AUDIO_FORMAT = os.environ.get("ASR_AUDIO_FORMAT", "mp3")
+ASR_AUDIO_SAMPLE_RATE = int(os.environ.get("ASR_AUDIO_SAMPLE_RATE", 16000))
+ASR_AUDIO_BITRATE = os.environ.get("ASR_AUDIO_BITRATE", "32k")
+# 长音频按静音点切分：每段不超过 ASR_CHUNK_SECONDS 秒，且不超过接口的上传大小限制
+ASR_CHUNK_SECONDS = float(os.environ.get("ASR_CHUNK_SECONDS", 600))
+ASR_MAX_UPLOAD_BYTES = int(os.environ.get("ASR_MAX_UPLOAD_BYTES", 24 * 1024 * 1024))
+SILENCE_NOISE_DB = float(os.environ.get("SILENCE_NOISE_DB", -35))
+SILENCE_MIN_SECONDS = float(os.environ.get("SILENCE_MIN_SECONDS", 0.4))
+
+# 格式 -> (文件扩展名, ffmpeg 容器格式, 编码器参数)
+AUDIO_FORMATS = {
+    "mp3": ("mp3", "mp3", ["-c:a", "libmp3lame"]),
+    "opus": ("ogg", "ogg", ["-c:a", "libopus", "-application", "voip"]),
+}
+
+
+def get_ffmpeg_binary() -> str:
+    if binary := os.environ.get("FFMPEG_BINARY"):
+        return binary
+    if platform.system() == "Windows" and os.path.exists("C:\\ffmpeg\\bin\\ffmpeg.exe"):
+        return "C:\\ffmpeg\\bin\\ffmpeg.exe"
+    return shutil.which("ffmpeg") or "ffmpeg"
+
+
+def get_ffprobe_binary() -> str:
+    ffmpeg = get_ffmpeg_binary()
+    directory, name = os.path.split(ffmpeg)
+    return os.path.join(directory, name.replace("ffmpeg", "ffprobe"))
+
+
+def get_audio_extension(audio_format: str = ASR_AUDIO_FORMAT) -> str:
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"不支持的音频格式：{audio_format}")
+    return AUDIO_FORMATS[audio_format][0]
+
+
+def _run(cmd: list) -> subprocess.CompletedProcess:
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"{os.path.basename(cmd[0])} 执行失败 ({result.returncode}): {stderr[-2000:]}")
+    return result
+
+
+def run_ffmpeg(args: list) -> subprocess.CompletedProcess:
+    return _run([get_ffmpeg_binary(), "-nostdin", "-hide_banner", *args])
+
+
+def get_audio_duration(audio_path: str) -> float:
+    result = _run([
+        get_ffprobe_binary(),
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        audio_path,
+    ])
+    return float(result.stdout.decode("utf-8").strip())
+
+
+def detect_silences(
+        audio_path: str,
+        noise_db: float = SILENCE_NOISE_DB,
+        min_seconds: float = SILENCE_MIN_SECONDS,
+) -> List[Tuple[float, float]]:
+    # 由 ffmpeg 流式分析静音区间，Python 侧只解析日志输出
+    result = run_ffmpeg([
+        "-i", audio_path,
+        "-af", f"silencedetect=noise={noise_db}dB:d={min_seconds}",
+        "-f", "null", "-",
+    ])
+    log = result.stderr.decode("utf-8", errors="replace")
+    starts = [float(v) for v in re.findall(r"silence_start: (-?[\d.]+)", log)]
+    ends = [float(v) for v in re.findall(r"silence_end: ([\d.]+)", log)]
+    return [(max(0.0, start), end) for start, end in zip(starts, ends)]
+
+
+def plan_chunks(
+        duration: float,
+        silences: List[Tuple[float, float]],
+        max_seconds: float,
+) -> List[Tuple[float, float]]:
+    # 在每段允许的最大长度内，选择最靠后的静音中点作为切分点；找不到静音时直接按最大长度切分
+    chunks = []
+    start = 0.0
+    while duration - start > max_seconds:
+        limit = start + max_seconds
+        cut = None
+        for silence_start, silence_end in silences:
+            middle = (silence_start + silence_end) / 2
+            if start + max_seconds / 2 <= middle <= limit:
+                cut = middle
+        if cut is None:
+            cut = limit
+        chunks.append((start, cut))
+        start = cut
+    chunks.append((start, duration))
+    return chunks
+
+
+def split_audio(
+        audio_path: str,
+        max_seconds: float = ASR_CHUNK_SECONDS,
+        max_bytes: int = ASR_MAX_UPLOAD_BYTES,
+        audio_format: str = ASR_AUDIO_FORMAT,
+        bitrate: str = ASR_AUDIO_BITRATE,
+) -> List[Tuple[str, float]]:
+    # 返回 (分段文件路径, 起始偏移秒数)；较短的音频原样作为唯一分段返回
+    duration = get_audio_duration(audio_path)
+    size = os.path.getsize(audio_path)
+    if duration > 0 and size > max_bytes:
+        # 按平均码率估算，留 10% 余量
+        max_seconds = min(max_seconds, duration * max_bytes / size * 0.9)
+    if duration <= max_seconds:
+        return [(audio_path, 0.0)]
+
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"不支持的音频格式：{audio_format}")
+    _, container, codec_args = AUDIO_FORMATS[audio_format]
+    silences = detect_silences(audio_path)
+    base, ext = os.path.splitext(audio_path)
+    chunks = []
+    for i, (start, end) in enumerate(plan_chunks(duration, silences, max_seconds)):
+        chunk_path = f"{base}.chunk{i:03d}{ext}"
+        # 重新编码而不是 -c copy：流复制只能在数据包边界切分，分段的实际起点与 start 不一致，拼接后的时间戳会漂移；
+        # 解码后切分精确到采样点，start 即分段的真实起点。音频已是低码率单声道，重新编码很快
+        run_ffmpeg([
+            "-loglevel", "error",
+            "-y",
+            "-ss", f"{start:.3f}",
+            "-t", f"{end - start:.3f}",
+            "-i", audio_path,
+            "-vn",
+            *codec_args,
+            "-b:a", bitrate,
+            "-f", container,
+            chunk_path,
+        ])
+        chunks.append((chunk_path, start))
+    return chunks
+
+
+def extract_audio(
+        video_path: str,
+        audio_path: str,
+        audio_format: str = ASR_AUDIO_FORMAT,
+        sample_rate: int = ASR_AUDIO_SAMPLE_RATE,
+        bitrate: str = ASR_AUDIO_BITRATE,
+):
+    # 一次 ffmpeg 调用直接从视频解码并编码为目标格式，不产生中间 WAV，也不在 Python 内存中缓存整段音频
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"不支持的音频格式：{audio_format}")
+    _, container, codec_args = AUDIO_FORMATS[audio_format]
+    # 先写入临时文件再重命名，中断时不会留下不完整的音频
+    temp_path = f"{audio_path}.part"
+    try:
+        run_ffmpeg([
+            "-loglevel", "error",
+            "-y",
+            "-i", video_path,
+            "-vn", "-sn", "-dn",
+            "-ac", "1",
+            "-ar", str(sample_rate),
+            *codec_args,
+            "-b:a", bitrate,
+            "-f", container,
+            temp_path,
+        ])
+        os.replace(temp_path, audio_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
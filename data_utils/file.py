@@ -1,10 +1,80 @@
 import hashlib
+import json
+import os
+import threading
+from typing import Optional, Callable
+
+# 大块读取，减少系统调用次数；hashlib 在处理大块数据时会释放 GIL
+HASH_BUFFER_SIZE = 1024 * 1024
 
 
 def generate_checksum(filename):
     sha256_hash = hashlib.sha256()
-    with open(filename, "rb") as f:
-        # Read and update hash string value in blocks of 4K
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
\ No newline at end of file
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(filename, "rb", buffering=0) as f:
+        while size := f.readinto(buffer):
+            sha256_hash.update(view[:size])
+    return sha256_hash.hexdigest()
+
+
+class ChecksumManifest:
+    # 以路径为键记录文件的大小、修改时间、inode 与校验和，文件未变化时无需重新读取
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"校验和清单损坏，将重新计算: {e}")
+
+    @staticmethod
+    def _fingerprint(stat: os.stat_result) -> dict:
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "inode": stat.st_ino,
+        }
+
+    def lookup(self, filename: str) -> Optional[str]:
+        key = os.path.abspath(filename)
+        fingerprint = self._fingerprint(os.stat(filename))
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if any(entry.get(k) != v for k, v in fingerprint.items()):
+            return None
+        return entry["checksum"]
+
+    def record(self, filename: str, checksum: str, stat: os.stat_result):
+        key = os.path.abspath(filename)
+        with self._lock:
+            self._entries[key] = {**self._fingerprint(stat), "checksum": checksum}
+            self._dirty = True
+
+    def checksum(self, filename: str, hash_func: Callable[[str], str] = generate_checksum) -> str:
+        if (checksum := self.lookup(filename)) is not None:
+            return checksum
+        # 先取 stat 再计算哈希：若文件在计算期间被修改，下次运行时 stat 不一致会重新计算
+        stat = os.stat(filename)
+        checksum = hash_func(filename)
+        self.record(filename, checksum, stat)
+        return checksum
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            # 只保留仍然存在的文件
+            entries = {k: v for k, v in self._entries.items() if os.path.exists(k)}
+            temp_path = f"{self._path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(temp_path, self._path)
+            self._entries = entries
+            self._dirty = False
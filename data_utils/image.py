@@ -1,5 +1,28 @@
 import base64
+import os
 from io import BytesIO
+from typing import Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# 发送给视觉模型前的预处理：按 EXIF 旋正、可选裁剪到文字区域与转灰度、缩小后重新压缩编码；
+# 关闭时按原样发送（文件原始字节或原格式，无格式时为 PNG）
+IMAGE_PREPROCESS = os.environ.get("IMAGE_PREPROCESS", "true").lower() in ("1", "true", "yes")
+# 长边与短边上限：detail=high 时模型会把图片缩放到 2048 以内、短边 768，超出的像素只增加上传字节
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", 2048))
+IMAGE_MAX_SHORT_EDGE = int(os.environ.get("IMAGE_MAX_SHORT_EDGE", 768))
+# 编码格式（jpeg / webp / png）与 jpeg、webp 的压缩质量
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+IMAGE_GRAYSCALE = os.environ.get("IMAGE_GRAYSCALE", "false").lower() in ("1", "true", "yes")
+IMAGE_CROP_TEXT = os.environ.get("IMAGE_CROP_TEXT", "false").lower() in ("1", "true", "yes")
+# 传给视觉模型的 detail：low（固定 512x512，token 最少）/ high / auto
+IMAGE_DETAIL = os.environ.get("IMAGE_DETAIL", "auto").lower()
+# detail=low 时模型只看 512x512
+LOW_DETAIL_EDGE = 512
+
+_FORMATS = {"jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP", "png": "PNG"}
 
 
 def image_file_to_base64(image_path: str) -> str:
@@ -21,3 +44,84 @@ def image_data_to_base64(image):
     img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
     base64_url = f"data:image/{image_format.lower()};base64,{img_str}"
     return base64_url
+
+
+def text_bbox(image: Image.Image, margin: float = 0.03) -> Optional[Tuple[int, int, int, int]]:
+    # 文字区域：在缩小的灰度图中找明显比背景（中位数亮度）暗的像素，按行、列投影，
+    # 去掉两侧几乎没有墨迹的边缘；找不到或区域过小时返回 None
+    small = image.convert("L")
+    small.thumbnail((512, 512))
+    gray = np.asarray(small, dtype=np.float32)
+    ink = gray < np.median(gray) - 40
+    rows = np.flatnonzero(ink.mean(axis=1) > 0.005)
+    cols = np.flatnonzero(ink.mean(axis=0) > 0.005)
+    if not len(rows) or not len(cols):
+        return None
+    scale_x, scale_y = image.width / small.width, image.height / small.height
+    pad_x, pad_y = margin * image.width, margin * image.height
+    box = (
+        max(0, int(cols[0] * scale_x - pad_x)),
+        max(0, int(rows[0] * scale_y - pad_y)),
+        min(image.width, int((cols[-1] + 1) * scale_x + pad_x)),
+        min(image.height, int((rows[-1] + 1) * scale_y + pad_y)),
+    )
+    if (box[2] - box[0]) * (box[3] - box[1]) < 0.1 * image.width * image.height:
+        return None
+    return box
+
+
+def preprocess_image(
+        image: Union[str, Image.Image],
+        detail: str = IMAGE_DETAIL,
+        max_edge: int = IMAGE_MAX_EDGE,
+        max_short_edge: int = IMAGE_MAX_SHORT_EDGE,
+        grayscale: bool = IMAGE_GRAYSCALE,
+        crop_text: bool = IMAGE_CROP_TEXT,
+) -> Image.Image:
+    # 手机照片的方向记录在 EXIF 中，像素本身可能是横着的；exif_transpose 总是返回已加载的新图片，
+    # 从路径打开时读入像素后即可关闭文件
+    if isinstance(image, str):
+        with Image.open(image) as opened:
+            image = ImageOps.exif_transpose(opened)
+    else:
+        image = ImageOps.exif_transpose(image)
+    if crop_text and (box := text_bbox(image)) is not None:
+        image = image.crop(box)
+    if grayscale:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        # 透明背景按白色合成，jpeg 不支持透明通道
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        image = background
+    if detail == "low":
+        max_edge = min(max_edge or LOW_DETAIL_EDGE, LOW_DETAIL_EDGE)
+    scale = 1.0
+    if max_edge:
+        scale = min(scale, max_edge / max(image.size))
+    if max_short_edge and detail != "low":
+        scale = min(scale, max_short_edge / min(image.size))
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    return image
+
+
+def encode_image(image: Image.Image, image_format: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> str:
+    image_format = _FORMATS.get(image_format, "JPEG")
+    buffered = BytesIO()
+    if image_format == "PNG":
+        image.save(buffered, format="PNG", optimize=True)
+    else:
+        image.save(buffered, format=image_format, quality=quality, optimize=True)
+    img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    return f"data:image/{image_format.lower()};base64,{img_str}"
+
+
+def image_to_base64(image: Union[str, Image.Image], detail: str = IMAGE_DETAIL) -> str:
+    if not IMAGE_PREPROCESS:
+        if isinstance(image, str):
+            return image_file_to_base64(image)
+        return image_data_to_base64(image)
+    return encode_image(preprocess_image(image, detail=detail))
@@ -1,18 +1,19 @@
+import hashlib
 import json
 import os, re
-import platform
-from typing import Optional
-
-import moviepy.editor as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Callable, Optional
 
 from ai_services.asr import OpenAIASRService
+from ai_services.batch import BatchRunner
 from ai_services.llm import OpenAILLMService
-from data_utils.file import generate_checksum
+from data_utils import audio
+from data_utils.artifact import ArtifactStore
+from data_utils.file import generate_checksum, ChecksumManifest
 from prompt_template import PromptTemplate
-from pydub import AudioSegment
-from pydub.utils import which
-if platform.system() == "Windows":
-    AudioSegment.converter = which("C:\\ffmpeg\\bin\\ffmpeg")
+
+# 单个视频的音频分段并发转写数
+ASR_CHUNK_WORKERS = int(os.environ.get("ASR_CHUNK_WORKERS", 4))
 
 
 def parse_summary(text: str) -> str:
@@ -21,50 +22,204 @@ def parse_summary(text: str) -> str:
     return summaries[-1].strip() if summaries else text
 
 
+def extract_audio(video_path: str, audio_path: str):
+    # 模块级函数，便于在进程池中执行
+    if not video_path.lower().endswith((".mov", ".mp4")):
+        raise ValueError(f"视频格式不支持：{video_path}")
+    audio.extract_audio(video_path, audio_path)
+
+
+def _run_inline(stage: str, func: Callable, *args):
+    return func(*args)
+
+
 class MovVideoLoader:
-    def __init__(self):
+    def __init__(
+            self,
+            hash_workers: int = 1,
+            extract_workers: int = 1,
+            asr_workers: int = 1,
+            llm_workers: int = 1,
+            batch_runner: BatchRunner = None,
+    ):
         self.prompt_template = PromptTemplate.from_file("prompts/video_display_text.txt")
-        llm_model = os.environ.get("LLM_MODEL", "gpt-4o")
-        asr_model = os.environ.get("ASR_MODEL", "whisper-1")
-        self.llm = OpenAILLMService(llm_model)
-        self.asr = OpenAIASRService(asr_model)
+        self.llm_model = os.environ.get("LLM_MODEL", "gpt-4o")
+        self.asr_model = os.environ.get("ASR_MODEL", "whisper-1")
+        self.seed = int(os.environ.get("SEED", 42))
+        self.llm = OpenAILLMService(self.llm_model)
+        self.asr = OpenAIASRService(self.asr_model)
         self.temp_dir = self.create_temp_dir()
+        self.artifacts = ArtifactStore(os.path.join(self.temp_dir, "artifacts"))
+        self.manifest = ChecksumManifest(os.path.join(self.temp_dir, "checksums.json"))
+        # 各阶段的并发上限：哈希与音频提取（ffmpeg）占用 CPU，使用进程池；ASR 与 LLM 等待网络，使用线程池
+        self.stage_workers = {
+            "hash": max(1, hash_workers),
+            "extract": max(1, extract_workers),
+            "asr": max(1, asr_workers),
+            "llm": max(1, llm_workers),
+        }
+        # 设置后，摘要阶段不再逐个同步调用，而是在所有视频转写完成后统一提交批处理任务
+        self.batch_runner = batch_runner
 
     def load(self, path: str) -> dict | list:
         if os.path.isfile(path):
             print(f"Loading video: {os.path.abspath(path)}")
-            return self.load_video(path)
+            try:
+                return self.load_video(path)
+            finally:
+                self.manifest.save()
         elif os.path.isdir(path):
-            results = []
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    if file.lower().endswith(".mov") or file.lower().endswith(".mp4"):
-                        res = self.load(os.path.join(root, file))
-                        results.append(res)
-            return results
+            return self.load_videos(self.find_videos(path))
         else:
             raise ValueError(f"Invalid path: {path}")
 
-    def data_exists(self, checksum: str) -> Optional[dict]:
-        if os.path.exists(os.path.join(self.temp_dir, f"{checksum}.json")):
-            data = json.load(open(
-                os.path.join(self.temp_dir, f"{checksum}.json"),
-                "r",
-                encoding="utf-8"
-            ))
-            return data
-        return None
-
-    def load_video(self, path: str) -> dict:
-        checksum = generate_checksum(path)
-        video_filename = self.get_video_title(path)
-        if (data := self.data_exists(checksum)) is not None:
-            return data
-        audio_path = os.path.join(self.temp_dir, f"{video_filename}.mp3")
-        self.extract_audio(path, audio_path)
-        transcription = self.transcribe_audio(os.path.abspath(audio_path))
-        display_text = self.generate_display_text(transcription)
-        display_text = parse_summary(display_text)
+    @staticmethod
+    def find_videos(path: str) -> List[str]:
+        video_paths = []
+        for root, dirs, files in os.walk(path):
+            for file in files:
+                if file.lower().endswith(".mov") or file.lower().endswith(".mp4"):
+                    video_paths.append(os.path.join(root, file))
+        return video_paths
+
+    def load_videos(self, paths: List[str]) -> List[dict]:
+        if not paths:
+            return []
+        workers = self.stage_workers
+        with ProcessPoolExecutor(max_workers=workers["hash"]) as hash_pool, \
+                ProcessPoolExecutor(max_workers=workers["extract"]) as extract_pool, \
+                ThreadPoolExecutor(max_workers=workers["asr"]) as asr_pool, \
+                ThreadPoolExecutor(max_workers=workers["llm"]) as llm_pool:
+            pools = {
+                "hash": hash_pool,
+                "extract": extract_pool,
+                "asr": asr_pool,
+                "llm": llm_pool,
+            }
+
+            def run_stage(stage: str, func: Callable, *args):
+                return pools[stage].submit(func, *args).result()
+
+            def load_one(video_path: str):
+                print(f"Loading video: {os.path.abspath(video_path)}")
+                if self.batch_runner is not None:
+                    return self.prepare_video(video_path, run_stage)
+                return self.load_video(video_path, run_stage)
+
+            # 每个视频由一个调度线程依次提交到各阶段的池中，调度线程数足以让所有阶段同时满载
+            try:
+                with ThreadPoolExecutor(max_workers=sum(workers.values())) as drivers:
+                    futures = [drivers.submit(load_one, p) for p in paths]
+                    results = [future.result() for future in futures]
+            finally:
+                self.manifest.save()
+        if self.batch_runner is not None:
+            results = self.load_prepared_in_batch(results)
+        return results
+
+    def stage_keys(self, checksum: str) -> dict:
+        # 每个阶段的键都包含上游阶段的键，上游变化时下游随之失效
+        audio_key = ArtifactStore.make_key(
+            "audio", checksum, audio.ASR_AUDIO_FORMAT, audio.ASR_AUDIO_SAMPLE_RATE, audio.ASR_AUDIO_BITRATE
+        )
+        transcript_key = ArtifactStore.make_key("transcript", audio_key, self.asr_model)
+        prompt_hash = hashlib.sha256(self.prompt_template.get_template().encode("utf-8")).hexdigest()
+        display_text_key = ArtifactStore.make_key(
+            "display_text", transcript_key, self.llm_model, prompt_hash, self.seed
+        )
+        return {
+            "audio": audio_key,
+            "transcript": transcript_key,
+            "display_text": display_text_key,
+        }
+
+    def prepare_video(self, path: str, run_stage: Callable = _run_inline) -> dict:
+        # 文件大小、修改时间与 inode 未变化时直接使用清单中的校验和，否则在哈希进程池中重新计算
+        checksum = self.manifest.checksum(
+            path,
+            lambda filename: run_stage("hash", generate_checksum, filename)
+        )
+        # 从最后一个已完成的阶段继续，只重新计算输入发生变化的阶段
+        keys = self.stage_keys(checksum)
+        transcription = self.artifacts.load_json("transcript", keys["transcript"])
+        if transcription is None:
+            transcription = self.import_legacy_cache(checksum, keys)
+        if transcription is None:
+            audio_path = self.artifacts.path("audio", keys["audio"], audio.get_audio_extension())
+            if not os.path.exists(audio_path):
+                run_stage("extract", extract_audio, path, audio_path)
+            transcription = run_stage("asr", self.transcribe_audio, os.path.abspath(audio_path))
+            self.artifacts.save_json("transcript", keys["transcript"], transcription)
+        return {
+            "path": path,
+            "checksum": checksum,
+            "keys": keys,
+            "transcription": transcription,
+        }
+
+    def import_legacy_cache(self, checksum: str, keys: dict) -> Optional[dict]:
+        # 旧版本把每个视频的转写与摘要保存在 .tmp/<校验和>.json 中，导入为当前的转写与摘要产物，升级后不必重新转写
+        legacy_path = os.path.join(self.temp_dir, f"{checksum}.json")
+        if not os.path.exists(legacy_path):
+            return None
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            transcription = {"text": data["metadata"]["transcript"], "segments": data.get("segments") or []}
+            display_text = data["metadata"]["display_text"]
+        except (OSError, json.JSONDecodeError, KeyError) as e:
+            print(f"旧缓存无法读取，将重新计算 {legacy_path}: {e}")
+            return None
+        self.artifacts.save_json("transcript", keys["transcript"], transcription)
+        if self.artifacts.load_json("display_text", keys["display_text"]) is None:
+            # 没有 <summary> 标签时 parse_summary 原样返回
+            self.artifacts.save_json("display_text", keys["display_text"], {"raw": display_text})
+        return transcription
+
+    def load_video(self, path: str, run_stage: Callable = _run_inline) -> dict:
+        if self.batch_runner is not None:
+            return self.load_prepared_in_batch([self.prepare_video(path, run_stage)])[0]
+        prepared = self.prepare_video(path, run_stage)
+        summary = self.artifacts.load_json("display_text", prepared["keys"]["display_text"])
+        if summary is None:
+            summary = {"raw": run_stage("llm", self.generate_display_text, prepared["transcription"])}
+            self.artifacts.save_json("display_text", prepared["keys"]["display_text"], summary)
+        return self.build_video_data(prepared, summary["raw"])
+
+    def load_prepared_in_batch(self, prepared_videos: List[dict]) -> List[dict]:
+        # 把所有缺少摘要的视频写入同一个批处理任务，完成后写回产物库
+        requests = {}
+        for prepared in prepared_videos:
+            key = prepared["keys"]["display_text"]
+            if key in requests or self.artifacts.load_json("display_text", key) is not None:
+                continue
+            requests[key] = {
+                "model": self.llm_model,
+                "messages": [{"role": "user", "content": self.build_prompt(prepared["transcription"])}],
+                "temperature": 0,
+                "seed": self.seed,
+            }
+        if requests:
+            print(f"以批处理方式生成 {len(requests)} 个视频摘要")
+            responses = self.batch_runner.run("/v1/chat/completions", requests)
+            for key, body in responses.items():
+                self.artifacts.save_json("display_text", key, {"raw": body["choices"][0]["message"]["content"]})
+
+        results = []
+        for prepared in prepared_videos:
+            summary = self.artifacts.load_json("display_text", prepared["keys"]["display_text"])
+            if summary is None:
+                # 批处理中失败的请求改为同步调用
+                summary = {"raw": self.generate_display_text(prepared["transcription"])}
+                self.artifacts.save_json("display_text", prepared["keys"]["display_text"], summary)
+            results.append(self.build_video_data(prepared, summary["raw"]))
+        return results
+
+    def build_video_data(self, prepared: dict, raw_summary: str) -> dict:
+        path = prepared["path"]
+        checksum = prepared["checksum"]
+        transcription = prepared["transcription"]
+        display_text = parse_summary(raw_summary)
         title = self.get_video_title(path)
         current_directory = os.getcwd()
         target_file = os.path.abspath(path)
@@ -77,10 +232,18 @@ class MovVideoLoader:
                 "display_text": display_text,
                 "source_url": relative_path.replace(os.path.sep, '/'),
                 "checksum": checksum
-            }
+            },
+            # Whisper 分段（带时间戳），用于分段级索引；不写入视频级向量的 payload
+            "segments": [
+                {
+                    "start": segment["start"],
+                    "end": segment["end"],
+                    "text": segment["text"].strip(),
+                }
+                for segment in transcription.get("segments") or []
+                if segment["text"].strip()
+            ],
         }
-        self.save_video_metadata(data, checksum)
-        # print(json.dumps(data, indent=4, ensure_ascii=False))
         return data
 
     @staticmethod
@@ -92,42 +255,37 @@ class MovVideoLoader:
         os.makedirs(temp_dir, exist_ok=True)
         return temp_dir
 
-    def extract_audio(self, video_path, audio_path):
-        if video_path.lower().endswith(".mov"):
-            video = mp.VideoFileClip(video_path)
-            audio = video.audio
-
-            # 将音频提取到临时文件
-            filename = self.get_video_title(video_path)
-            temp_wav_path = os.path.join(self.temp_dir, f"{filename}_temp.wav")
-            audio.write_audiofile(temp_wav_path)
-            video.close()
-            audio = AudioSegment.from_wav(temp_wav_path)
-            audio.export(audio_path, format="mp3")
-            # 删除临时 WAV 文件
-            os.remove(temp_wav_path)
-        elif video_path.lower().endswith(".mp4"):
-            audio = AudioSegment.from_file(video_path, format='mp4')
-            audio.export(audio_path, format="mp3")
-        else:
-            raise ValueError(f"视频格式不支持：{video_path}")
+    @staticmethod
+    def extract_audio(video_path, audio_path):
+        extract_audio(video_path, audio_path)
 
     @staticmethod
     def transcribe_audio(audio_path) -> dict:
-        trans = OpenAIASRService().transcribe(
-            audio_path,
-            timestamp_granularities=["segment"]
-        )
+        # 长音频在静音处切分后并发转写，时间戳按分段偏移拼接
+        chunks = audio.split_audio(audio_path)
+        try:
+            trans = OpenAIASRService().transcribe_chunks(
+                chunks,
+                max_workers=ASR_CHUNK_WORKERS,
+                timestamp_granularities=["segment"]
+            )
+        finally:
+            for chunk_path, _ in chunks:
+                if chunk_path != audio_path and os.path.exists(chunk_path):
+                    os.remove(chunk_path)
         return trans
 
-    def generate_display_text(self, transcription) -> str:
+    def build_prompt(self, transcription) -> str:
         text = transcription["text"]
         formatted_segments = self.format_segments(transcription)
-        prompt = self.prompt_template.invoke(text=text, segments=formatted_segments)
+        return self.prompt_template.invoke(text=text, segments=formatted_segments)
+
+    def generate_display_text(self, transcription) -> str:
+        prompt = self.build_prompt(transcription)
         display_text = self.llm.invoke(
             prompt,
             temperature=0,
-            seed=int(os.environ.get("SEED", 42))
+            seed=self.seed
         )
         return display_text
 
@@ -154,14 +312,6 @@ class MovVideoLoader:
             )
         return "\n".join(formatted_segments)
 
-    def save_video_metadata(self, data, video_filename):
-        with open(
-                os.path.join(self.temp_dir, f"{video_filename}.json"),
-                "w",
-                encoding="utf-8"
-        ) as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-
     @staticmethod
     def get_video_title(path) -> str:
         # filename without extension is the title
@@ -1,3 +1,5 @@
+import asyncio
+import hashlib
 import json
 import os
 import re
@@ -6,6 +8,7 @@ from typing import Any, Union
 from PIL.Image import Image
 
 from ai_services.llm import OpenAILLMService
+from ai_services.singleflight import SingleFlight
 from prompt_template import PromptTemplate
 from singleton import singleton
 
@@ -25,6 +28,19 @@ def parse_json_from_text(text) -> dict | list:
     return json.loads(obj_str)
 
 
+def image_fingerprint(image: Union[str, Image]) -> str:
+    # 相同图片（相同文件内容或相同像素）得到相同的键
+    sha256_hash = hashlib.sha256()
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            for byte_block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256_hash.update(byte_block)
+    else:
+        sha256_hash.update(f"{image.mode}:{image.size}".encode("utf-8"))
+        sha256_hash.update(image.tobytes())
+    return sha256_hash.hexdigest()
+
+
 @singleton
 class ImageDescriber:
 
@@ -32,8 +48,20 @@ class ImageDescriber:
         self._prompt_template = PromptTemplate.from_file("prompts/image_to_keyword.txt")
         llm_model = os.environ.get("LLM_MODEL", "gpt-4o")
         self._llm = OpenAILLMService(llm_model)
+        self._flight = SingleFlight()
+
+    def flight_stats(self) -> dict:
+        return self._flight.stats()
 
     def invoke(self, image: Union[str, Image]) -> Any:
+        return self._flight.do(image_fingerprint(image), lambda: self._invoke(image))
+
+    async def ainvoke(self, image: Union[str, Image]) -> Any:
+        # 大图的像素哈希需要几十毫秒，放到线程中计算以免阻塞事件循环
+        key = await asyncio.to_thread(image_fingerprint, image)
+        return await self._flight.ado(key, lambda: self._ainvoke(image))
+
+    def _invoke(self, image: Union[str, Image]) -> Any:
         prompt = self._prompt_template.invoke()
         response = self._llm.invoke(
             prompt,
@@ -48,6 +76,20 @@ class ImageDescriber:
             keywords = []
         return keywords
 
+    async def _ainvoke(self, image: Union[str, Image]) -> Any:
+        prompt = self._prompt_template.invoke()
+        response = await self._llm.ainvoke(
+            prompt,
+            images=[image],
+            temperature=0,
+            seed=int(os.environ.get("SEED", 42))
+        )
+        try:
+            keywords = parse_json_from_text(response)
+        except json.JSONDecodeError:
+            keywords = []
+        return keywords
+
 
 if __name__ == "__main__":
     from dotenv import load_dotenv, find_dotenv
@@ -1,37 +1,160 @@
-from typing import List, Union
+import asyncio
+import threading
+from typing import List, Optional, Union
 
 from PIL.Image import Image
 
-from ai_services.cache import MiscCache
+from ai_services.cache import ResultCache, RankedResults
+from ai_services.singleflight import SingleFlight
 from main.image_processor import ImageDescriber
+from main.warm_cache import (
+    SEARCH_FIELDS,
+    RESULT_CACHE_DEPTH,
+    WARM_CACHE,
+    WarmCache,
+    normalize_keywords,
+    refresh_warm_cache,
+    warm_cache_path,
+)
 import os
 
-from vdb.vector_store import VectorStore
+from vdb.vector_store import VectorStore, OUTLINE_FILE
 
 MAX_VIDEO_COUNT = int(os.environ.get("MAX_SEARCH_RESULTS", 10))
 
 COLLECTION_NAME = os.environ.get("COLLECTION_NAME")
 vector_store = VectorStore(COLLECTION_NAME)
 
-cache = MiscCache()
+result_cache = ResultCache()
+# 同一时刻多个用户拍摄同一页时，相同的检索只执行一次
+search_flight = SingleFlight()
+# 当前索引版本的预计算结果：(版本, WarmCache)
+warm_cache = None
+warm_lock = threading.Lock()
+warm_thread = None
+warm_thread_lock = threading.Lock()
+warm_hits = 0
 
 
-def filter_results(results, threshold) -> List[dict]:
-    return [result for result in results if result['score'] >= threshold]
+def warm_up() -> Optional[WarmCache]:
+    # 读取当前索引版本预计算的结果，没有时（如升级前建立的索引）现场计算并保存
+    global warm_cache
+    if not WARM_CACHE or not OUTLINE_FILE:
+        return None
+    with warm_lock:
+        version = vector_store.check_version()
+        if warm_cache is not None and warm_cache[0] == version:
+            return warm_cache[1]
+        path = warm_cache_path(vector_store.path, COLLECTION_NAME)
+        if os.path.exists(path):
+            cache = WarmCache.load(path)
+        else:
+            try:
+                cache = refresh_warm_cache(vector_store, COLLECTION_NAME)
+            except OSError as e:
+                # 索引目录只读或已被清理时只保留在内存中
+                print(f"预计算结果保存失败: {e}")
+                return None
+        warm_cache = (version, cache)
+        print(f"已加载索引版本 {version} 的 {len(cache)} 个预计算关键字")
+        return cache
+
+
+def start_warm_up():
+    # 在后台线程中加载，不阻塞启动与检索
+    global warm_thread
+    if not WARM_CACHE or not OUTLINE_FILE:
+        return
+    with warm_thread_lock:
+        if warm_thread is not None and warm_thread.is_alive():
+            return
+        warm_thread = threading.Thread(target=warm_up, daemon=True)
+        warm_thread.start()
+
+
+def get_warm_lists(keywords: List[str], version: str) -> Optional[List[List[dict]]]:
+    # 预计算结果属于旧版本时在后台重新加载，本次照常检索
+    global warm_hits
+    cache = warm_cache
+    if cache is None:
+        return None
+    if cache[0] != version:
+        start_warm_up()
+        return None
+    lists = cache[1].get_lists(keywords, SEARCH_FIELDS, RESULT_CACHE_DEPTH)
+    if lists is not None:
+        warm_hits += 1
+    return lists
+
+
+def get_coalescing_stats() -> dict:
+    return {
+        "search": search_flight.stats(),
+        "image": ImageDescriber().flight_stats(),
+    }
+
+
+def make_query_key(keywords: List[str], version: str = None) -> str:
+    # 关键字顺序不影响检索结果，缓存与合并请求时按排序后的关键字集合作为键；
+    # 键中包含索引版本，切换版本后不会读到旧版本的结果
+    return "\x1f".join([str(version), *sorted(set(keywords))])
+
+
+def get_result_cache_stats() -> dict:
+    cache = warm_cache
+    return {
+        **result_cache.stats(),
+        "warm_keywords": len(cache[1]) if cache is not None else 0,
+        "warm_hits": warm_hits,
+    }
 
 
 def get_keywords_from_image(image: Union[str, Image]) -> List[str]:
     return ImageDescriber().invoke(image)
 
 
-def search_videos_by_keywords(keywords: List[str], threshold: float) -> List[dict]:
+async def aget_keywords_from_image(image: Union[str, Image]) -> List[str]:
+    return await ImageDescriber().ainvoke(image)
+
+
+def search_videos_by_keywords(keywords: List[str], threshold: float, top_k: int = MAX_VIDEO_COUNT) -> List[dict]:
+    keywords = normalize_keywords(keywords)
+    if not keywords:
+        return []
+    version = vector_store.check_version()
+    query = make_query_key(keywords, version)
+    if (ranked := result_cache.get(query)) is None:
+        def search() -> RankedResults:
+            # 关键字都有预计算结果时直接融合，不调用嵌入接口
+            if (lists := get_warm_lists(keywords, version)) is not None:
+                results = vector_store.fuse_lists(lists, top_k=RESULT_CACHE_DEPTH, fields=SEARCH_FIELDS)
+            else:
+                results = vector_store.search_batch(keywords, top_k=RESULT_CACHE_DEPTH, fields=SEARCH_FIELDS)
+            return result_cache.set(query, results)
+
+        ranked = search_flight.do(query, search)
+
+    return ranked.select(threshold, top_k)
+
+
+async def asearch_videos_by_keywords(keywords: List[str], threshold: float, top_k: int = MAX_VIDEO_COUNT) -> List[dict]:
+    keywords = normalize_keywords(keywords)
     if not keywords:
         return []
-    query = ", ".join(keywords)
-    if (results := cache.get(query)) is not None:
-        pass
-    else:
-        results = vector_store.search(query, top_k=MAX_VIDEO_COUNT)
-        cache.set(query, results)
-
-    return filter_results(results, threshold)
+    # 切换版本时需要重新打开索引，放到线程中执行
+    version = await asyncio.to_thread(vector_store.check_version)
+    query = make_query_key(keywords, version)
+    if (ranked := result_cache.get(query)) is None:
+        async def search() -> RankedResults:
+            if (lists := get_warm_lists(keywords, version)) is not None:
+                # fuse_lists 会检查索引版本并读取文档库，同样放到线程中执行
+                results = await asyncio.to_thread(
+                    vector_store.fuse_lists, lists, top_k=RESULT_CACHE_DEPTH, fields=SEARCH_FIELDS,
+                )
+            else:
+                results = await vector_store.asearch_batch(keywords, top_k=RESULT_CACHE_DEPTH, fields=SEARCH_FIELDS)
+            return result_cache.set(query, results)
+
+        ranked = await search_flight.ado(query, search)
+
+    return ranked.select(threshold, top_k)
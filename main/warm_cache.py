@@ -0,0 +1,136 @@
+import gzip
+import json
+import os
+from typing import Dict, List, Optional
+
+from data_utils.outline import load_outlines_from_file
+from vdb.vector_store import VectorStore, OUTLINE_FILE
+
+# 检索结果只读取界面需要的字段，完整转写等大字段不会被读取
+SEARCH_FIELDS = ["title", "display_text", "source_url", "checksum", "start", "end", "chapter"]
+# 每次检索缓存的结果条数，阈值与返回条数在其中截取
+RESULT_CACHE_DEPTH = int(os.environ.get("RESULT_CACHE_DEPTH", 100))
+# 预计算大纲中各章节与知识点的检索结果（需要设置 OUTLINE_FILE），随索引版本保存在 <索引目录>/warm 中
+WARM_CACHE = os.environ.get("WARM_CACHE", "true").lower() in ("1", "true", "yes")
+# 预计算时每次嵌入与检索的关键字数
+WARM_CACHE_BATCH = int(os.environ.get("WARM_CACHE_BATCH", 256))
+
+
+def normalize_keywords(keywords: List[str]) -> List[str]:
+    # 去掉首尾空白并合并中间的连续空白，使写法不同的相同关键字命中同一个缓存键
+    return [" ".join(keyword.split()) for keyword in keywords if keyword and keyword.strip()]
+
+
+def outline_keywords(outlines: Dict[str, List[str]]) -> List[str]:
+    # 图片识别出的关键字大多是教材中的知识点：大纲中的章标题与各知识点
+    keywords = []
+    for chapter, items in outlines.items():
+        keywords.append(chapter)
+        keywords.extend(items)
+    return list(dict.fromkeys(normalize_keywords(keywords)))
+
+
+def warm_cache_path(index_path: str, collection_name: str) -> str:
+    return os.path.join(index_path, "warm", f"{collection_name}.json.gz")
+
+
+class WarmCache:
+    # 关键字 -> 该关键字单独检索的排序结果（按视频融合之前）。一次检索的关键字都在其中时直接融合，
+    # 不需要调用嵌入接口，也不需要检索索引；结果只对生成它的索引版本有效
+    def __init__(self, fields: List[str], depth: int, results: Dict[str, List[dict]]):
+        self.fields = fields
+        self.depth = depth
+        self.results = results
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def get_lists(self, keywords: List[str], fields: List[str], depth: int) -> Optional[List[List[dict]]]:
+        # 检索参数与预计算时不同，或有关键字不在其中时返回 None
+        if fields != self.fields or depth != self.depth:
+            return None
+        lists = [self.results.get(keyword) for keyword in dict.fromkeys(keywords)]
+        return None if any(results is None for results in lists) else lists
+
+    @classmethod
+    def build(
+            cls,
+            vector_store: VectorStore,
+            keywords: List[str],
+            fields: List[str] = SEARCH_FIELDS,
+            depth: int = RESULT_CACHE_DEPTH,
+    ) -> "WarmCache":
+        results = {}
+        for start in range(0, len(keywords), WARM_CACHE_BATCH):
+            batch = keywords[start:start + WARM_CACHE_BATCH]
+            results.update(zip(batch, vector_store.search_lists(batch, top_k=depth, fields=fields)))
+        return cls(fields, depth, results)
+
+    def save(self, path: str):
+        # 视频的公共字段只存一份，每条结果记录得分以及与公共字段的差异：不同或多出的字段、缺少的字段与不同的文本。
+        # 同一视频在一个关键字下是分段命中（有 start / end），在另一个关键字下是整段命中（没有），缺少的字段也要记录
+        documents = {}
+        entries = {}
+        for keyword, results in self.results.items():
+            rows = []
+            for result in results:
+                key = result['metadata'].get('checksum') or result['text']
+                doc = documents.setdefault(key, {'text': result['text'], 'metadata': result['metadata']})
+                overrides = {
+                    k: v for k, v in result['metadata'].items()
+                    if k not in doc['metadata'] or doc['metadata'][k] != v
+                }
+                removed = [k for k in doc['metadata'] if k not in result['metadata']]
+                text = result['text'] if result['text'] != doc['text'] else None
+                rows.append([key, result['score'], result.get('fusion_score'), overrides, removed, text])
+            entries[keyword] = rows
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.part"
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump({
+                "fields": self.fields,
+                "depth": self.depth,
+                "documents": documents,
+                "results": entries,
+            }, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "WarmCache":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        documents = data["documents"]
+        results = {}
+        for keyword, rows in data["results"].items():
+            results[keyword] = []
+            for key, score, fusion_score, overrides, removed, text in rows:
+                metadata = {**documents[key]['metadata'], **overrides}
+                for k in removed:
+                    del metadata[k]
+                result = {
+                    'text': documents[key]['text'] if text is None else text,
+                    'metadata': metadata,
+                    'score': score,
+                }
+                if fusion_score is not None:
+                    result['fusion_score'] = fusion_score
+                results[keyword].append(result)
+        return cls(data["fields"], data["depth"], results)
+
+
+def refresh_warm_cache(vector_store: VectorStore, collection_name: str) -> Optional[WarmCache]:
+    # 为 vector_store 所在的索引目录重新计算并保存；未开启时删除（从旧版本复制来的）过期结果
+    path = warm_cache_path(vector_store.path, collection_name)
+    if not WARM_CACHE or not OUTLINE_FILE:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    keywords = outline_keywords(load_outlines_from_file(OUTLINE_FILE))
+    cache = WarmCache.build(vector_store, keywords)
+    cache.save(path)
+    # 保存时只记录与公共字段的差异，读回后必须与检索结果完全一致，否则界面会把结果当作 search_batch 的结果使用
+    if WarmCache.load(path).results != cache.results:
+        os.remove(path)
+        raise ValueError(f"预计算结果读回后与检索结果不一致: {path}")
+    print(f"预计算 {len(cache)} 个大纲关键字的检索结果")
+    return cache
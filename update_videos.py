@@ -1,27 +1,191 @@
 from dotenv import load_dotenv, find_dotenv
 
-from vdb.vector_store import VectorStore
-
+# 先加载 .env，各模块在导入时读取环境变量
 load_dotenv(find_dotenv())
+
+from vdb.vector_store import VectorStore, EmbeddingMismatchError, VECTOR_BACKEND, INDEX_ROOT, INDEX_DIRS
+from main.warm_cache import refresh_warm_cache
+from vdb.versions import IndexVersions
+import argparse
 import os
-import shutil
+from ai_services.batch import BatchRunner, OpenAIBatchBackend
+from ai_services.cache import EmbeddingCache
 from data_utils.video import MovVideoLoader
 
 VIDEO_DIR = os.environ.get("VIDEO_DIR", "videos")
 WORKING_DIR = os.environ.get("WORKING_DIR", "data")
+# 各处理阶段的并发上限
+INGEST_HASH_WORKERS = int(os.environ.get("INGEST_HASH_WORKERS", os.cpu_count() or 1))
+INGEST_EXTRACT_WORKERS = int(os.environ.get("INGEST_EXTRACT_WORKERS", 2))
+INGEST_ASR_WORKERS = int(os.environ.get("INGEST_ASR_WORKERS", 4))
+INGEST_LLM_WORKERS = int(os.environ.get("INGEST_LLM_WORKERS", 4))
+# 批处理模式：openai 使用 Batch API；为空时逐个同步调用
+BATCH_BACKEND = os.environ.get("BATCH_BACKEND", "")
+
+
+def create_batch_runner():
+    if not BATCH_BACKEND:
+        return None
+    # 批处理的结果按真实模型的键写入产物库，只能使用真实的接口
+    if BATCH_BACKEND != "openai":
+        raise ValueError(f"不支持的批处理后端: {BATCH_BACKEND}")
+    return BatchRunner(OpenAIBatchBackend(), os.path.join(WORKING_DIR, ".tmp", "batches"))
+
+
+def prefetch_embeddings(vector_store: VectorStore, documents: list, batch_runner: BatchRunner = None):
+    # 批处理模式下，嵌入缓存中还没有的向量先以批处理方式计算并写入缓存，入库时的嵌入直接命中缓存；
+    # 本地嵌入后端不需要批处理接口
+    if batch_runner is None or vector_store.embedding_provider != "openai":
+        return
+    model, size = vector_store.embedding_model, vector_store.vector_size
+    cache = EmbeddingCache()
+    texts = list(dict.fromkeys(doc["text"] for doc in documents))
+    keys = {
+        cache.make_key(model, text, size): text
+        for text, vector in zip(texts, cache.get_many(model, texts, size))
+        if vector is None
+    }
+    if not keys:
+        return
+    requests = {}
+    for key, text in keys.items():
+        requests[key] = {"model": model, "input": text}
+        if size:
+            requests[key]["dimensions"] = size
+    print(f"以批处理方式计算 {len(requests)} 个向量")
+    responses = batch_runner.run("/v1/embeddings", requests)
+    # 批处理中失败的请求在入库时同步计算
+    done = [key for key in keys if key in responses]
+    cache.set_many(model, [keys[key] for key in done], [responses[key]["data"][0]["embedding"] for key in done], size)
+
+
+def sync_documents(vector_store: VectorStore, videos_data: list, batch_runner: BatchRunner = None) -> int:
+    # 对比集合中已有的校验和与磁盘上的视频，只写入新增/变更的视频，并删除源文件已不存在的文档
+    stored = vector_store.get_stored_checksums()
+    on_disk = {}
+    for data in videos_data:
+        on_disk.setdefault(data["metadata"]["checksum"], data)
+
+    added = [data for checksum, data in on_disk.items() if checksum not in stored]
+    removed = [checksum for checksum in stored if checksum not in on_disk]
+    moved = 0
+    for checksum, data in on_disk.items():
+        if checksum not in stored:
+            continue
+        metadata = {k: data["metadata"][k] for k in ("source_url", "title")}
+        if any(stored[checksum].get(k) != v for k, v in metadata.items()):
+            vector_store.update_metadata(checksum, metadata)
+            moved += 1
+
+    vector_store.delete_documents(removed)
+    if added:
+        prefetch_embeddings(vector_store, added, batch_runner)
+        vector_store.add_documents(added)
+    backfilled = 0
+    if vector_store.segment_index:
+        # 新开启分段索引时，为已入库但还没有分段向量的视频补建分段
+        stored_segments = vector_store.get_stored_checksums(segments=True)
+        missing = [
+            data for checksum, data in on_disk.items()
+            if checksum in stored and checksum not in stored_segments
+        ]
+        if missing:
+            vector_store.add_segments(missing)
+            backfilled = len(missing)
+            print(f"补建分段索引 {len(missing)} 个")
+    lexical_built = vector_store.ensure_lexical_index()
+    # 设置大纲前入库的视频补充分配小节
+    sectioned = vector_store.ensure_outline_sections()
+    print(f"新增 {len(added)} 个，删除 {len(removed)} 个，更新路径 {moved} 个，未变化 {len(on_disk) - len(added) - moved} 个")
+    # 返回变更数，为 0 时不需要切换索引版本
+    return len(added) + len(removed) + moved + backfilled + int(lexical_built) + sectioned
+
+
+def rollback(versions: IndexVersions):
+    previous = versions.previous()
+    if previous is None:
+        print("没有可回滚的旧版本")
+        return
+    versions.activate(previous)
+    print(f"已回滚到索引版本 {previous}")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="更新视频索引")
+    parser.add_argument("--full", action="store_true", help="不复用现有索引，全部重建")
+    parser.add_argument("--rollback", action="store_true", help="切换回上一个索引版本")
+    args = parser.parse_args()
+
+    # 索引总是写入新的版本目录，完成后再切换 CURRENT 指针，webui.py 无需停止
+    versions = IndexVersions(os.path.join(WORKING_DIR, INDEX_ROOT))
+    if args.rollback:
+        rollback(versions)
+        return
+
     data_dir = os.path.abspath(os.path.join(WORKING_DIR, VIDEO_DIR))
-    video_loader = MovVideoLoader()
+    batch_runner = create_batch_runner()
+    video_loader = MovVideoLoader(
+        hash_workers=INGEST_HASH_WORKERS,
+        extract_workers=INGEST_EXTRACT_WORKERS,
+        asr_workers=INGEST_ASR_WORKERS,
+        llm_workers=INGEST_LLM_WORKERS,
+        batch_runner=batch_runner,
+    )
     videos_data = video_loader.load(data_dir)
-    vdb_dir = os.path.join(WORKING_DIR, "qdrant_data")
-    if os.path.exists(vdb_dir):
-        shutil.rmtree(vdb_dir)
     COLLECTION_NAME = os.environ.get("COLLECTION_NAME")
-    vector_store = VectorStore(COLLECTION_NAME)
-    vector_store.add_documents(videos_data)
-    vector_store.persist()
+
+    # 上次构建中途失败时，在保留的版本上继续（已写入的文档不再重复嵌入）；--full 时丢弃
+    current = versions.current()
+    unfinished = [version for version in versions.unfinished() if versions.backend(version) == VECTOR_BACKEND]
+    resume = unfinished[-1] if unfinished and not args.full else None
+    for version in versions.unfinished():
+        if version != resume:
+            versions.discard(version)
+    if resume is not None:
+        version, full = resume, False
+        print(f"继续构建未完成的索引版本 {version}")
+    else:
+        # 增量更新在当前版本（或升级前的旧索引目录）的副本上进行；索引后端改变时只能全量重建
+        if current is not None:
+            source, source_backend = versions.path(current["version"]), current["backend"]
+        else:
+            source, source_backend = os.path.join(WORKING_DIR, INDEX_DIRS[VECTOR_BACKEND]), VECTOR_BACKEND
+        full = args.full or source_backend != VECTOR_BACKEND or not os.path.isdir(source)
+        version = versions.create(VECTOR_BACKEND, source=None if full else source)
+        print(f"{'全量' if full else '增量'}构建索引版本 {version}")
+    try:
+        try:
+            vector_store = VectorStore(COLLECTION_NAME, backend=VECTOR_BACKEND, path=versions.path(version))
+        except EmbeddingMismatchError as e:
+            # 嵌入后端、模型或维度改变后，旧向量不能与新的查询向量比较，只能全量重建
+            print(f"{e}，改为全量构建")
+            versions.discard(version)
+            version, full = versions.create(VECTOR_BACKEND), True
+            vector_store = VectorStore(COLLECTION_NAME, backend=VECTOR_BACKEND, path=versions.path(version))
+        if full:
+            prefetch_embeddings(vector_store, videos_data, batch_runner)
+            vector_store.add_documents(videos_data)
+            changes = len(videos_data)
+        else:
+            # 继续未完成的构建时同样按校验和对比，补齐缺少的文档并删除多余的文档
+            changes = sync_documents(vector_store, videos_data, batch_runner)
+        unchanged = resume is None and not full and changes == 0 and current is not None
+        if not unchanged:
+            # 新版本切换前预计算大纲关键字的检索结果，webui 切换到新版本后直接加载
+            refresh_warm_cache(vector_store, COLLECTION_NAME)
+        vector_store.persist()
+        vector_store.close()
+    except BaseException:
+        # 当前版本不受影响；保留已写入的部分，下次运行时继续
+        print(f"索引版本 {version} 构建失败，下次运行时继续")
+        raise
+    if unchanged:
+        versions.discard(version)
+        print("索引没有变化")
+    else:
+        versions.activate(version)
+        versions.prune()
+        print(f"已切换到索引版本 {version}")
     print("Done!")
 
 
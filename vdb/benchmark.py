@@ -0,0 +1,93 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from vdb.flat_index import FlatIndex
+
+# 两阶段检索的召回率与延迟对比：python -m vdb.benchmark --count 20000 --dim 1024 --prefix-dims 128,256
+
+
+def make_corpus(count: int, dim: int, queries: int, seed: int = 0):
+    # 合成数据：带聚类结构，且方差随维度递减，近似 Matryoshka 嵌入“前面的维度信息更多”的特点
+    rng = np.random.default_rng(seed)
+    decay = np.arange(1, dim + 1, dtype=np.float32) ** -0.5
+    centers = rng.normal(size=(max(1, count // 50), dim)).astype(np.float32) * decay
+    labels = rng.integers(len(centers), size=count)
+    vectors = centers[labels] + 0.5 * rng.normal(size=(count, dim)).astype(np.float32) * decay
+    picked = rng.integers(count, size=queries)
+    query_vectors = vectors[picked] + 0.5 * rng.normal(size=(queries, dim)).astype(np.float32) * decay
+    return vectors.astype(np.float32), query_vectors.astype(np.float32)
+
+
+def build_index(path: str, vectors: np.ndarray, prefix_dim: int, quantize: bool, oversample: float) -> FlatIndex:
+    index = FlatIndex(path, prefix_dim=prefix_dim, quantize=quantize, oversample=oversample)
+    index.ensure_collection("bench", vectors.shape[1])
+    index.upsert("bench", [str(i) for i in range(len(vectors))], vectors, [{} for _ in range(len(vectors))])
+    return index
+
+
+def run(index: FlatIndex, queries: np.ndarray, top_k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        hits = index.search("bench", query, top_k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([hit.id for hit in hits])
+    return results, np.asarray(latencies)
+
+
+def candidate_bytes(path: str) -> int:
+    directory = os.path.join(path, "bench")
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for name in os.listdir(directory)
+        if name.startswith(("candidates.", "scales."))
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="两阶段向量检索基准")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--prefix-dims", default="128,256")
+    parser.add_argument("--oversample", type=float, default=4)
+    parser.add_argument("--vectors", help="使用 .npy 中的真实向量代替合成数据（随机抽取其中的向量作为查询）")
+    args = parser.parse_args()
+
+    if args.vectors:
+        vectors = np.load(args.vectors).astype(np.float32)
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.integers(len(vectors), size=args.queries)]
+    else:
+        vectors, queries = make_corpus(args.count, args.dim, args.queries)
+    prefix_dims = [int(dim) for dim in args.prefix_dims.split(",") if dim.strip()]
+    configs = [("exact", 0, False), ("int8", 0, True)]
+    for dim in prefix_dims:
+        configs += [(f"prefix-{dim}", dim, False), (f"prefix-{dim}+int8", dim, True)]
+
+    print(f"{len(vectors)} 个向量，{vectors.shape[1]} 维，{len(queries)} 个查询，top-{args.top_k}，候选 x{args.oversample}")
+    print(f"{'配置':<20}{'召回率':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'候选矩阵(MB)':>14}")
+    truth = None
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, prefix_dim, quantize in configs:
+            path = os.path.join(temp_dir, name)
+            index = build_index(path, vectors, prefix_dim, quantize, args.oversample)
+            results, latencies = run(index, queries, args.top_k)
+            if truth is None:
+                truth = results
+            recall = np.mean([len(set(got) & set(expected)) / len(expected) for got, expected in zip(results, truth)])
+            print(
+                f"{name:<20}{recall:>8.3f}{np.percentile(latencies, 50):>10.2f}"
+                f"{np.percentile(latencies, 95):>10.2f}{candidate_bytes(path) / 2 ** 20:>14.1f}"
+            )
+            index.close()
+
+
+if __name__ == "__main__":
+    main()
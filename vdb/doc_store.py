@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+
+INDEX_FILE = "index.json"
+# 压缩级别；无效数据超过有效数据时重写数据文件
+DOC_STORE_COMPRESS_LEVEL = int(os.environ.get("DOC_STORE_COMPRESS_LEVEL", 6))
+
+
+class DocStore:
+    # 大字段（如完整转写）的外部存储：每个文档压缩后追加到数据文件，index.json 记录 键 -> [偏移, 长度]，读取时按需解压。
+    # 与向量索引一样只有一个写者；数据文件只追加，index.json 原子替换，读者总能读到完整的记录
+    def __init__(self, directory: str):
+        self._dir = directory
+        self._lock = threading.Lock()
+        self._stat = None
+        self._data_file = None
+        self._previous_data_file = None
+        self._docs: Dict[str, List[int]] = {}
+        self._garbage = 0
+
+    def _index_path(self) -> str:
+        return os.path.join(self._dir, INDEX_FILE)
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self._index_path())
+            stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            stat = None
+        if stat == self._stat:
+            return
+        if stat is None:
+            self._data_file, self._docs, self._garbage = None, {}, 0
+        else:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self._data_file = index["data"]
+            self._previous_data_file = index.get("previous")
+            self._docs = index["docs"]
+            self._garbage = index["garbage"]
+        self._stat = stat
+
+    def _save_index(self):
+        temp_path = f"{self._index_path()}.part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "data": self._data_file,
+                "previous": self._previous_data_file,
+                "docs": self._docs,
+                "garbage": self._garbage,
+            }, f)
+        os.replace(temp_path, self._index_path())
+        stat = os.stat(self._index_path())
+        self._stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        for attempt in range(2):
+            with self._lock:
+                if attempt:
+                    # 读取期间写者连续压缩了两次，旧数据文件已删除，重新读取索引
+                    self._stat = None
+                self._refresh()
+                locations = [self._docs.get(key) for key in keys]
+                data_file = self._data_file
+            try:
+                return self._read(data_file, locations)
+            except FileNotFoundError:
+                if attempt:
+                    raise
+
+    def _read(self, data_file: Optional[str], locations: List[Optional[List[int]]]) -> List[Optional[Dict[str, Any]]]:
+        results = [None] * len(locations)
+        if data_file is None or not any(locations):
+            return results
+        # 按偏移顺序读取，减少随机寻道
+        order = sorted((i for i, location in enumerate(locations) if location), key=lambda i: locations[i][0])
+        with open(os.path.join(self._dir, data_file), "rb") as f:
+            for i in order:
+                offset, length = locations[i]
+                f.seek(offset)
+                results[i] = json.loads(zlib.decompress(f.read(length)))
+        return results
+
+    def put_many(self, docs: Dict[str, Dict[str, Any]]):
+        if not docs:
+            return
+        with self._lock:
+            self._refresh()
+            os.makedirs(self._dir, exist_ok=True)
+            if self._data_file is None:
+                self._data_file = "docs.1.bin"
+            with open(os.path.join(self._dir, self._data_file), "ab") as f:
+                offset = f.tell()
+                for key, doc in docs.items():
+                    record = json.dumps(doc, ensure_ascii=False).encode("utf-8")
+                    record = zlib.compress(record, DOC_STORE_COMPRESS_LEVEL)
+                    f.write(record)
+                    if key in self._docs:
+                        self._garbage += self._docs[key][1]
+                    self._docs[key] = [offset, len(record)]
+                    offset += len(record)
+            self._compact_if_needed()
+            self._save_index()
+
+    def delete_many(self, keys: List[str]):
+        with self._lock:
+            self._refresh()
+            removed = [self._docs.pop(key) for key in keys if key in self._docs]
+            if not removed:
+                return
+            self._garbage += sum(length for _, length in removed)
+            self._compact_if_needed()
+            self._save_index()
+
+    def _compact_if_needed(self):
+        live = sum(length for _, length in self._docs.values())
+        if self._garbage <= max(live, 1 << 20):
+            return
+        # 只拷贝有效记录到新的数据文件；旧文件保留一代，给正在读取的进程
+        generation = int(self._data_file.split(".")[1]) + 1
+        data_file = f"docs.{generation}.bin"
+        docs = {}
+        with open(os.path.join(self._dir, self._data_file), "rb") as src, \
+                open(os.path.join(self._dir, data_file), "wb") as dst:
+            for key, (offset, length) in sorted(self._docs.items(), key=lambda item: item[1][0]):
+                src.seek(offset)
+                docs[key] = [dst.tell(), length]
+                dst.write(src.read(length))
+        if self._previous_data_file:
+            try:
+                os.remove(os.path.join(self._dir, self._previous_data_file))
+            except OSError:
+                pass
+        self._previous_data_file = self._data_file
+        self._data_file = data_file
+        self._docs = docs
+        self._garbage = 0
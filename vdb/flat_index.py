@@ -0,0 +1,595 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from vdb.index import (
+    SearchHit, VectorIndex, Where, top_k,
+    VECTOR_PREFIX_DIM, VECTOR_QUANTIZE, VECTOR_RESCORE_OVERSAMPLE,
+)
+
+META_FILE = "meta.json"
+LOCK_FILE = "write.lock"
+# 候选打分时每次转换为 float32 的行数：块小到能留在 CPU 缓存中，int8 展开的开销才不会超过省下的内存带宽
+CANDIDATE_CHUNK_ROWS = 2048
+
+
+def _lock_exclusive(f):
+    # 非阻塞的排他锁，进程退出时由操作系统自动释放
+    if os.name == "nt":
+        import msvcrt
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # 入库与查询时都归一化，点积即余弦相似度
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def build_candidates(vectors: np.ndarray, prefix_dim: int = 0, quantize: bool = False):
+    # 候选矩阵：截断到前 prefix_dim 维后重新归一化（Matryoshka），可选再按行做 int8 标量量化
+    if prefix_dim and prefix_dim < vectors.shape[1]:
+        vectors = _normalize(vectors[:, :prefix_dim])
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not quantize:
+        return vectors, None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def candidate_scores(
+        candidates: np.ndarray,
+        scales: Optional[np.ndarray],
+        rows: Optional[np.ndarray],
+        queries: np.ndarray,
+) -> np.ndarray:
+    # 第一阶段的近似得分 (行数, 查询数)，分块展开 int8 矩阵
+    queries = _normalize(queries[:, :candidates.shape[1]])
+    count = len(rows) if rows is not None else len(candidates)
+    scores = np.empty((count, len(queries)), dtype=np.float32)
+    for start in range(0, count, CANDIDATE_CHUNK_ROWS):
+        end = start + CANDIDATE_CHUNK_ROWS
+        block = candidates[start:end] if rows is None else candidates[rows[start:end]]
+        scores[start:end] = np.asarray(block, dtype=np.float32) @ queries.T
+    if scales is not None:
+        scores *= np.asarray(scales if rows is None else scales[rows])[:, None]
+    return scores
+
+
+class _FlatCollection:
+    # 一个集合的数据分为两部分：基础段 vectors.<代>.f32（float32 行矩阵，内存映射读取）与 payloads.<代>.jsonl
+    # （每行一个 id 与载荷）；以及只追加的增量段 delta.<代>.f32 / delta.<代>.jsonl 与墓碑 tombstones.<代>.i64
+    # （被删除或被覆盖的行号）。每次写入只在增量段末尾追加并原子替换很小的 meta.json，读者按其中记录的行数与字节数读取，
+    # 看不到写到一半的数据；写者 flush / 关闭时把两部分合并为新的一代，上一代的文件保留给正在读取的进程
+    def __init__(self, directory: str, dimension: int, prefix_dim: int = 0, quantize: bool = False):
+        self.directory = directory
+        self.dimension = dimension
+        # 写入时使用的两阶段配置；读取时以 meta.json 中记录的候选矩阵为准
+        self.prefix_dim = prefix_dim
+        self.quantize = quantize
+        self._load_empty()
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, META_FILE)
+
+    def refresh(self):
+        # 其他进程写入了新的数据时重新打开，未变化时只多一次 stat
+        try:
+            stat = os.stat(self._meta_path())
+            stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            stat = None
+        if stat == self._meta_stat:
+            return
+        if stat is None:
+            self._load_empty()
+            return
+        for _ in range(5):
+            try:
+                self._load()
+                return
+            except FileNotFoundError:
+                # 打开期间写者又提交了两代，旧文件已被清理，读取最新的 meta 重试
+                continue
+        self._load()
+
+    def _load_empty(self):
+        self._meta_stat = None
+        self._meta = {}
+        self._generation = 0
+        self._files = []
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.payloads: List[Dict[str, Any]] = []
+        self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        self.deleted = set()
+        self.candidates, self.scales = None, None
+        self._live = None
+        self._buffer = None
+        self._field_indexes: Dict[str, Dict[Any, List[int]]] = {}
+
+    def _load(self):
+        meta_path = self._meta_path()
+        stat = os.stat(meta_path)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["dimension"] != self.dimension:
+            raise ValueError(f"索引维度 {meta['dimension']} 与当前向量维度 {self.dimension} 不一致，请重建索引")
+        count = meta["count"]
+        vectors_path = os.path.join(self.directory, meta["vectors"])
+        if count:
+            vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(count, self.dimension))
+        else:
+            vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        candidates, scales = None, None
+        if count and (candidate_meta := meta.get("candidates")):
+            candidates = np.memmap(
+                os.path.join(self.directory, candidate_meta["file"]),
+                dtype=candidate_meta["dtype"], mode="r", shape=(count, candidate_meta["dim"]),
+            )
+            if candidate_meta.get("scales"):
+                scales = np.memmap(
+                    os.path.join(self.directory, candidate_meta["scales"]), dtype=np.float32, mode="r", shape=(count,)
+                )
+        ids, payloads = [], []
+        with open(os.path.join(self.directory, meta["payloads"]), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                payloads.append(record["payload"])
+        deleted = set()
+        if delta := meta.get("delta"):
+            if delta["count"]:
+                delta_vectors = np.memmap(
+                    os.path.join(self.directory, delta["vectors"]),
+                    dtype=np.float32, mode="r", shape=(delta["count"], self.dimension),
+                )
+                # 有增量时在内存中拼接；候选矩阵只覆盖基础段，合并之前使用精确检索
+                vectors = np.concatenate([vectors, delta_vectors])
+                candidates, scales = None, None
+            with open(os.path.join(self.directory, delta["payloads"]), "rb") as f:
+                data = f.read(delta["payloads_bytes"])
+            for line in data.decode("utf-8").splitlines():
+                record = json.loads(line)
+                ids.append(record["id"])
+                payloads.append(record["payload"])
+            if delta["deleted"]:
+                deleted = set(np.fromfile(
+                    os.path.join(self.directory, delta["tombstones"]), dtype=np.int64, count=delta["deleted"]
+                ).tolist())
+        self._meta_stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        self._generation = meta["generation"]
+        self._meta = meta
+        self._files = self._meta_files(meta)
+        self.ids = ids
+        self.rows = {_id: i for i, _id in enumerate(ids) if i not in deleted}
+        self.payloads = payloads
+        self.vectors = vectors
+        self.deleted = deleted
+        self.candidates = candidates
+        self.scales = scales
+        self._live = None
+        self._buffer = None
+        self._field_indexes = {}
+
+    @staticmethod
+    def _meta_files(meta: dict) -> List[str]:
+        files = [meta["vectors"], meta["payloads"]]
+        if candidate_meta := meta.get("candidates"):
+            files += [name for name in (candidate_meta["file"], candidate_meta.get("scales")) if name]
+        if delta := meta.get("delta"):
+            files += [delta["vectors"], delta["payloads"], delta["tombstones"]]
+        return files
+
+    def live_mask(self) -> Optional[np.ndarray]:
+        # 未被删除的行；没有墓碑时为 None。写入后失效，下次读取时重新计算
+        if not self.deleted:
+            return None
+        if self._live is None:
+            live = np.ones(len(self.ids), dtype=bool)
+            live[np.fromiter(self.deleted, dtype=np.int64, count=len(self.deleted))] = False
+            self._live = live
+        return self._live
+
+    def live_rows(self) -> Optional[np.ndarray]:
+        live = self.live_mask()
+        return None if live is None else np.flatnonzero(live)
+
+    def field_index(self, field: str) -> Dict[Any, List[int]]:
+        # 字段取值 -> 行号，按需建立，追加的行随写入加入，数据换代时失效；列表类型的字段按每个元素建立
+        if field not in self._field_indexes:
+            self._field_indexes[field] = {}
+            self._index_rows(field, 0)
+        return self._field_indexes[field]
+
+    def _index_rows(self, field: str, start: int):
+        index = self._field_indexes[field]
+        for row in range(start, len(self.payloads)):
+            value = self.payloads[row].get(field)
+            for item in value if isinstance(value, list) else [value]:
+                if item is not None:
+                    index.setdefault(item, []).append(row)
+
+    def match(self, where: Where) -> np.ndarray:
+        live = self.live_mask()
+        mask = np.ones(len(self.ids), dtype=bool) if live is None else live.copy()
+        for field, values in where.items():
+            index = self.field_index(field)
+            field_mask = np.zeros(len(self.ids), dtype=bool)
+            for value in values:
+                if value in index:
+                    field_mask[index[value]] = True
+            mask &= field_mask
+        return np.flatnonzero(mask)
+
+    def append(self, ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]], deleted: List[int]):
+        # 新行（ids 不重复）追加到增量段，deleted 为被删除或被新行覆盖的旧行号，写入量只与本次的行数有关
+        if not self._meta:
+            # 集合还没有数据文件，直接写入第一代
+            self.commit(ids, vectors, payloads)
+            return
+        generation = self._generation
+        delta = self._meta.get("delta") or {
+            "vectors": f"delta.{generation}.f32",
+            "payloads": f"delta.{generation}.jsonl",
+            "tombstones": f"tombstones.{generation}.i64",
+            "count": 0,
+            "payloads_bytes": 0,
+            "deleted": 0,
+        }
+        deleted = sorted(set(deleted) - self.deleted)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dimension)
+        data = "".join(
+            json.dumps({"id": _id, "payload": payload}, ensure_ascii=False) + "\n"
+            for _id, payload in zip(ids, payloads)
+        ).encode("utf-8")
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_at(delta["vectors"], delta["count"] * self.dimension * 4, vectors.tobytes())
+        self._write_at(delta["payloads"], delta["payloads_bytes"], data)
+        self._write_at(delta["tombstones"], delta["deleted"] * 8, np.asarray(deleted, dtype=np.int64).tobytes())
+        meta = {
+            **self._meta,
+            "delta": {
+                **delta,
+                "count": delta["count"] + len(ids),
+                "payloads_bytes": delta["payloads_bytes"] + len(data),
+                "deleted": delta["deleted"] + len(deleted),
+            },
+        }
+        self._write_meta(meta)
+
+        # 直接更新内存中的数据，不重新读取文件
+        start = len(self.ids)
+        self._reserve(start + len(ids))
+        self._buffer[start:start + len(ids)] = vectors
+        self.vectors = self._buffer[:start + len(ids)]
+        for row in deleted:
+            del self.rows[self.ids[row]]
+        self.deleted.update(deleted)
+        self.ids.extend(ids)
+        self.payloads.extend(payloads)
+        self.rows.update((_id, start + i) for i, _id in enumerate(ids))
+        for field in self._field_indexes:
+            self._index_rows(field, start)
+        self.candidates, self.scales = None, None
+        self._live = None
+        self._meta = meta
+        self._files = self._meta_files(meta)
+
+    def _reserve(self, count: int):
+        # 写者第一次追加时把向量复制到可增长的缓冲区，之后按倍数扩容，追加的均摊开销与写入量成正比
+        if self._buffer is not None and len(self._buffer) >= count:
+            return
+        capacity = max(count, 1024, 2 * len(self._buffer) if self._buffer is not None else 0)
+        buffer = np.empty((capacity, self.dimension), dtype=np.float32)
+        buffer[:len(self.vectors)] = self.vectors
+        self._buffer = buffer
+
+    def _write_at(self, filename: str, offset: int, data: bytes):
+        # 从 meta.json 记录的末尾写入：上次中断留下的多余字节被覆盖，未覆盖的部分不在记录的长度内
+        if not data:
+            return
+        path = os.path.join(self.directory, filename)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+
+    def _write_meta(self, meta: dict):
+        temp_path = f"{self._meta_path()}.part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self._meta_path())
+        stat = os.stat(self._meta_path())
+        self._meta_stat = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def compact(self):
+        # 把增量段与墓碑合并为新的一代，并重建候选矩阵
+        if not self._meta.get("delta"):
+            return
+        rows = self.live_rows()
+        if rows is None:
+            rows = np.arange(len(self.ids))
+        self.commit(
+            [self.ids[row] for row in rows],
+            np.asarray(self.vectors[rows], dtype=np.float32),
+            [self.payloads[row] for row in rows],
+        )
+
+    def commit(self, ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+        os.makedirs(self.directory, exist_ok=True)
+        generation = self._generation + 1
+        vectors_file = f"vectors.{generation}.f32"
+        self._write_array(vectors_file, np.asarray(vectors, dtype=np.float32))
+        candidate_meta = None
+        if self.prefix_dim or self.quantize:
+            codes, scales = build_candidates(np.asarray(vectors, dtype=np.float32), self.prefix_dim, self.quantize)
+            candidate_meta = {
+                "file": f"candidates.{generation}.{codes.dtype.name}",
+                "dtype": codes.dtype.name,
+                "dim": codes.shape[1],
+                "scales": f"scales.{generation}.f32" if scales is not None else None,
+            }
+            self._write_array(candidate_meta["file"], codes)
+            if scales is not None:
+                self._write_array(candidate_meta["scales"], scales)
+        payloads_file = f"payloads.{generation}.jsonl"
+        temp_path = os.path.join(self.directory, f"{payloads_file}.part")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for _id, payload in zip(ids, payloads):
+                f.write(json.dumps({"id": _id, "payload": payload}, ensure_ascii=False) + "\n")
+        os.replace(temp_path, os.path.join(self.directory, payloads_file))
+        self._write_meta({
+            "dimension": self.dimension,
+            "generation": generation,
+            "count": len(ids),
+            "vectors": vectors_file,
+            "payloads": payloads_file,
+            "candidates": candidate_meta,
+        })
+
+        previous_files = self._files
+        self._load()
+        # 保留上一代文件给正在读取的进程，更早的文件删除
+        keep = set(self._files) | set(previous_files) | {META_FILE, LOCK_FILE}
+        for filename in os.listdir(self.directory):
+            if filename not in keep and not filename.endswith(".part"):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    # Windows 下仍被其他进程映射的文件无法删除，下次提交时再清理
+                    pass
+
+    def _write_array(self, filename: str, array: np.ndarray):
+        temp_path = os.path.join(self.directory, f"{filename}.part")
+        np.ascontiguousarray(array).tofile(temp_path)
+        os.replace(temp_path, os.path.join(self.directory, filename))
+
+
+class FlatIndex(VectorIndex):
+    # 进程内的 NumPy 暴力检索：向量为内存映射的 float32 矩阵，查询为一次矩阵乘法加 argpartition。
+    # 读不加锁，可以有任意多个只读进程（如 webui.py）；写入时持有目录下的文件锁，同一时间只有一个写者
+    # 可选两阶段检索：先在候选矩阵（前缀 / int8）上选出候选，再用全精度向量重新打分
+    def __init__(
+            self,
+            path: str,
+            prefix_dim: int = VECTOR_PREFIX_DIM,
+            quantize: bool = VECTOR_QUANTIZE,
+            oversample: float = VECTOR_RESCORE_OVERSAMPLE,
+    ):
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        self._prefix_dim = prefix_dim
+        self._quantize = quantize
+        self._oversample = oversample
+        self._collections: Dict[str, _FlatCollection] = {}
+        self._lock = threading.RLock()
+        self._lock_file = None
+
+    def _collection(self, name: str) -> _FlatCollection:
+        if name not in self._collections:
+            raise ValueError(f"集合不存在: {name}")
+        collection = self._collections[name]
+        collection.refresh()
+        return collection
+
+    def _acquire_write_lock(self):
+        if self._lock_file is not None:
+            return
+        lock_file = open(os.path.join(self._path, LOCK_FILE), "a+b")
+        try:
+            _lock_exclusive(lock_file)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f"另一个进程正在写入索引 {self._path}")
+        self._lock_file = lock_file
+
+    def ensure_collection(self, name: str, dimension: int):
+        # 只登记集合，第一次写入时才创建文件，只读进程不会在磁盘上留下任何东西
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = _FlatCollection(
+                    os.path.join(self._path, name), dimension, self._prefix_dim, self._quantize
+                )
+            self._collections[name].refresh()
+
+    def upsert(self, name: str, ids: List[str], vectors, payloads: List[Dict[str, Any]]):
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        with self._lock:
+            self._acquire_write_lock()
+            collection = self._collection(name)
+            if vectors.shape[1] != collection.dimension:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与集合维度 {collection.dimension} 不一致")
+            # 同一批中重复的 id 以最后一次为准；已有的 id 旧行记为墓碑，新行追加
+            latest = list({_id: i for i, _id in enumerate(ids)}.values())
+            ids = [ids[i] for i in latest]
+            replaced = [collection.rows[_id] for _id in ids if _id in collection.rows]
+            collection.append(ids, vectors[latest], [payloads[i] for i in latest], replaced)
+
+    def _select(self, collection: _FlatCollection, ids: Optional[List[str]], where: Optional[Where]) -> set:
+        rows = set()
+        if ids is not None:
+            rows.update(collection.rows[_id] for _id in ids if _id in collection.rows)
+        if where is not None:
+            rows.update(collection.match(where).tolist())
+        return rows
+
+    def delete(self, name: str, ids: Optional[List[str]] = None, where: Optional[Where] = None):
+        with self._lock:
+            self._acquire_write_lock()
+            collection = self._collection(name)
+            rows = self._select(collection, ids, where)
+            if not rows:
+                return
+            collection.append([], np.zeros((0, collection.dimension), dtype=np.float32), [], list(rows))
+
+    def set_payload(
+            self,
+            name: str,
+            payload: Dict[str, Any],
+            ids: Optional[List[str]] = None,
+            where: Optional[Where] = None,
+    ):
+        # 修改载荷的行与覆盖写入相同：旧行记为墓碑，连同原向量追加新行
+        with self._lock:
+            self._acquire_write_lock()
+            collection = self._collection(name)
+            rows = sorted(self._select(collection, ids, where))
+            if not rows:
+                return
+            collection.append(
+                [collection.ids[row] for row in rows],
+                np.asarray(collection.vectors[rows], dtype=np.float32),
+                [{**collection.payloads[row], **payload} for row in rows],
+                rows,
+            )
+
+    @staticmethod
+    def _live_rows(collection: _FlatCollection) -> List[int]:
+        rows = collection.live_rows()
+        return list(range(len(collection.ids))) if rows is None else rows.tolist()
+
+    def scroll(self, name: str, fields: Optional[List[str]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        # 行号在持锁时确定：之后的写入只在列表末尾追加，不影响已确定的行
+        with self._lock:
+            collection = self._collection(name)
+            ids, payloads, rows = collection.ids, collection.payloads, self._live_rows(collection)
+        for row in rows:
+            _id, payload = ids[row], payloads[row]
+            if fields is not None:
+                payload = {k: payload[k] for k in fields if k in payload}
+            yield _id, payload
+
+    def scroll_vectors(
+            self,
+            name: str,
+            fields: Optional[List[str]] = None,
+    ) -> Iterator[Tuple[str, Dict[str, Any], np.ndarray]]:
+        # 字段索引在过滤时按需建立，不需要 create_field_index
+        with self._lock:
+            collection = self._collection(name)
+            ids, payloads, vectors = collection.ids, collection.payloads, collection.vectors
+            rows = self._live_rows(collection)
+        for row in rows:
+            _id, payload = ids[row], payloads[row]
+            if fields is not None:
+                payload = {k: payload[k] for k in fields if k in payload}
+            yield _id, payload, np.array(vectors[row])
+
+    def search(
+            self,
+            name: str,
+            vector,
+            limit: int,
+            where: Optional[Where] = None,
+            fields: Optional[List[str]] = None,
+    ) -> List[SearchHit]:
+        return self.search_batch(name, [vector], limit, where, fields)[0]
+
+    def search_batch(
+            self,
+            name: str,
+            vectors,
+            limit: int,
+            where: Optional[Where] = None,
+            fields: Optional[List[str]] = None,
+    ) -> List[List[SearchHit]]:
+        # 所有查询一次矩阵乘法：(查询数, 维度) @ (维度, 文档数)
+        queries = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1))
+        with self._lock:
+            collection = self._collection(name)
+            ids, payloads, vectors = collection.ids, collection.payloads, collection.vectors
+            candidates, scales = collection.candidates, collection.scales
+            rows = collection.match(where) if where else collection.live_rows()
+        count = len(rows) if rows is not None else len(ids)
+        candidate_limit = int(limit * self._oversample)
+        if candidates is not None and count > candidate_limit:
+            approx = candidate_scores(candidates, scales, rows, queries)
+            ranked = self._rescore(vectors, rows, queries, approx, limit, candidate_limit)
+        else:
+            ranked = self._exact(vectors, rows, queries, limit)
+        results = []
+        for hit_rows, hit_scores in ranked:
+            hits = []
+            for row, score in zip(hit_rows.tolist(), hit_scores.tolist()):
+                payload = payloads[row]
+                if fields is not None:
+                    payload = {k: payload[k] for k in fields if k in payload}
+                hits.append(SearchHit(ids[row], score, payload))
+            results.append(hits)
+        return results
+
+    @staticmethod
+    def _exact(vectors: np.ndarray, rows: Optional[np.ndarray], queries: np.ndarray, limit: int):
+        if rows is not None:
+            scores = vectors[rows] @ queries.T if len(rows) else np.zeros((0, len(queries)), dtype=np.float32)
+        else:
+            scores = vectors @ queries.T
+        ranked = []
+        for column in scores.T:
+            best = top_k(column, limit)
+            ranked.append((rows[best] if rows is not None else best, column[best]))
+        return ranked
+
+    @staticmethod
+    def _rescore(
+            vectors: np.ndarray,
+            rows: Optional[np.ndarray],
+            queries: np.ndarray,
+            approx: np.ndarray,
+            limit: int,
+            candidate_limit: int,
+    ):
+        ranked = []
+        for query, column in zip(queries, approx.T):
+            candidates = top_k(column, candidate_limit)
+            if rows is not None:
+                candidates = rows[candidates]
+            # 按行号顺序读取全精度向量，内存映射文件上接近顺序读
+            candidates = np.sort(candidates)
+            scores = vectors[candidates] @ query
+            best = top_k(scores, limit)
+            ranked.append((candidates[best], scores[best]))
+        return ranked
+
+    def flush(self):
+        # 写者把各集合的增量段合并为新的一代；只读进程没有增量可合并
+        with self._lock:
+            if self._lock_file is None:
+                return
+            for collection in self._collections.values():
+                collection.compact()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
@@ -0,0 +1,258 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+# 两阶段检索（仅 flat 后端）：先用截断的前缀向量（VECTOR_PREFIX_DIM，text-embedding-3 的向量可直接截断）和/或 int8 量化向量
+# 选出 limit * VECTOR_RESCORE_OVERSAMPLE 个候选，再用磁盘上的全精度向量重新打分；0 / false 表示关闭
+VECTOR_PREFIX_DIM = int(os.environ.get("VECTOR_PREFIX_DIM", 0))
+VECTOR_QUANTIZE = os.environ.get("VECTOR_QUANTIZE", "false").lower() in ("1", "true", "yes", "int8")
+VECTOR_RESCORE_OVERSAMPLE = float(os.environ.get("VECTOR_RESCORE_OVERSAMPLE", 4))
+
+# 过滤条件统一写成 {字段: [取值, ...]}，多个字段之间为“且”，字段内为“任一匹配”
+Where = Dict[str, List[Any]]
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition 选出前 k 个，只对这 k 个排序
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class SearchHit(NamedTuple):
+    id: str
+    score: float
+    payload: Dict[str, Any]
+
+
+class VectorIndex(ABC):
+    # 向量索引后端的统一接口，VectorStore 只通过这些方法读写
+    @abstractmethod
+    def ensure_collection(self, name: str, dimension: int):
+        ...
+
+    @abstractmethod
+    def upsert(self, name: str, ids: List[str], vectors, payloads: List[Dict[str, Any]]):
+        ...
+
+    @abstractmethod
+    def delete(self, name: str, ids: Optional[List[str]] = None, where: Optional[Where] = None):
+        ...
+
+    @abstractmethod
+    def set_payload(
+            self,
+            name: str,
+            payload: Dict[str, Any],
+            ids: Optional[List[str]] = None,
+            where: Optional[Where] = None,
+    ):
+        ...
+
+    @abstractmethod
+    def scroll(self, name: str, fields: Optional[List[str]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        ...
+
+    @abstractmethod
+    def scroll_vectors(
+            self,
+            name: str,
+            fields: Optional[List[str]] = None,
+    ) -> Iterator[Tuple[str, Dict[str, Any], np.ndarray]]:
+        # 与 scroll 相同，同时返回向量（用于计算质心等离线统计）
+        ...
+
+    def create_field_index(self, name: str, field: str):
+        # 为用于过滤的载荷字段建立索引；后端自动建立索引时不需要实现
+        pass
+
+    def flush(self):
+        # 把缓冲或增量的写入整理到磁盘（flat 索引合并增量段）；每次写入都已整理的后端不需要实现
+        pass
+
+    @abstractmethod
+    def search(
+            self,
+            name: str,
+            vector,
+            limit: int,
+            where: Optional[Where] = None,
+            fields: Optional[List[str]] = None,
+    ) -> List[SearchHit]:
+        # fields 为载荷中需要返回的字段，None 表示全部
+        ...
+
+    def search_batch(
+            self,
+            name: str,
+            vectors,
+            limit: int,
+            where: Optional[Where] = None,
+            fields: Optional[List[str]] = None,
+    ) -> List[List[SearchHit]]:
+        # 多个查询向量一次检索，后端没有批量接口时逐个查询
+        return [self.search(name, vector, limit, where, fields) for vector in vectors]
+
+    def close(self):
+        pass
+
+
+class QdrantIndex(VectorIndex):
+    # Qdrant 本地模式，数据保存在 path 目录中，同一时间只能被一个进程打开。
+    # 本地模式始终精确检索（忽略量化配置），也不支持载荷索引（调用时只会打印警告），
+    # 过滤时逐个检查载荷，因此不实现两阶段检索与 create_field_index
+    def __init__(self, path: str):
+        self._path = path
+        self._client = QdrantClient(path=path)
+
+    @staticmethod
+    def _filter(where: Where) -> models.Filter:
+        return models.Filter(
+            must=[
+                models.FieldCondition(key=key, match=models.MatchAny(any=list(values)))
+                for key, values in where.items()
+            ]
+        )
+
+    def ensure_collection(self, name: str, dimension: int):
+        collections = self._client.get_collections().collections
+        if not any(collection.name == name for collection in collections):
+            self._client.create_collection(
+                collection_name=name,
+                vectors_config=models.VectorParams(
+                    size=dimension, distance=models.Distance.COSINE
+                ),
+                optimizers_config=models.OptimizersConfigDiff(
+                    indexing_threshold=0,  # 即时索引
+                ),
+                hnsw_config=models.HnswConfigDiff(
+                    m=16,
+                    ef_construct=100,
+                    full_scan_threshold=10000,
+                ),
+                wal_config=models.WalConfigDiff(
+                    wal_capacity_mb=32,
+                ),
+                shard_number=1,
+                on_disk_payload=True,
+            )
+
+    def upsert(self, name: str, ids: List[str], vectors, payloads: List[Dict[str, Any]]):
+        vectors = np.asarray(vectors, dtype=np.float32).tolist()
+        points = [
+            models.PointStruct(id=_id, vector=vector, payload=payload)
+            for _id, vector, payload in zip(ids, vectors, payloads)
+        ]
+        self._client.upsert(collection_name=name, points=points)
+
+    def delete(self, name: str, ids: Optional[List[str]] = None, where: Optional[Where] = None):
+        if ids is not None:
+            self._client.delete(collection_name=name, points_selector=models.PointIdsList(points=ids))
+        if where is not None:
+            self._client.delete(
+                collection_name=name,
+                points_selector=models.FilterSelector(filter=self._filter(where)),
+            )
+
+    def set_payload(
+            self,
+            name: str,
+            payload: Dict[str, Any],
+            ids: Optional[List[str]] = None,
+            where: Optional[Where] = None,
+    ):
+        if ids is not None:
+            self._client.set_payload(collection_name=name, payload=payload, points=ids)
+        if where is not None:
+            self._client.set_payload(collection_name=name, payload=payload, points=self._filter(where))
+
+    def scroll(self, name: str, fields: Optional[List[str]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        offset = None
+        while True:
+            points, offset = self._client.scroll(
+                collection_name=name,
+                limit=256,
+                offset=offset,
+                with_payload=fields if fields is not None else True,
+                with_vectors=False,
+            )
+            for point in points:
+                yield str(point.id), point.payload
+            if offset is None:
+                break
+
+    def scroll_vectors(
+            self,
+            name: str,
+            fields: Optional[List[str]] = None,
+    ) -> Iterator[Tuple[str, Dict[str, Any], np.ndarray]]:
+        offset = None
+        while True:
+            points, offset = self._client.scroll(
+                collection_name=name,
+                limit=256,
+                offset=offset,
+                with_payload=fields if fields is not None else True,
+                with_vectors=True,
+            )
+            for point in points:
+                yield str(point.id), point.payload, np.asarray(point.vector, dtype=np.float32)
+            if offset is None:
+                break
+
+    def search(
+            self,
+            name: str,
+            vector,
+            limit: int,
+            where: Optional[Where] = None,
+            fields: Optional[List[str]] = None,
+    ) -> List[SearchHit]:
+        results = self._client.search(
+            collection_name=name,
+            query_vector=np.asarray(vector, dtype=np.float32).tolist(),
+            query_filter=self._filter(where) if where else None,
+            limit=limit,
+            with_payload=fields if fields is not None else True,
+        )
+        return [SearchHit(str(hit.id), hit.score, hit.payload) for hit in results]
+
+    def search_batch(
+            self,
+            name: str,
+            vectors,
+            limit: int,
+            where: Optional[Where] = None,
+            fields: Optional[List[str]] = None,
+    ) -> List[List[SearchHit]]:
+        query_filter = self._filter(where) if where else None
+        with_payload = fields if fields is not None else True
+        results = self._client.search_batch(
+            collection_name=name,
+            requests=[
+                models.SearchRequest(vector=vector, filter=query_filter, limit=limit, with_payload=with_payload)
+                for vector in np.asarray(vectors, dtype=np.float32).tolist()
+            ],
+        )
+        return [[SearchHit(str(hit.id), hit.score, hit.payload) for hit in hits] for hits in results]
+
+    def close(self):
+        self._client.close()
+
+
+def create_vector_index(backend: str, path: str) -> VectorIndex:
+    if backend == "qdrant":
+        return QdrantIndex(path)
+    if backend == "flat":
+        from vdb.flat_index import FlatIndex
+        return FlatIndex(path)
+    raise ValueError(f"不支持的向量索引后端: {backend}")
@@ -0,0 +1,122 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from vdb.index import top_k
+
+BM25_K1 = float(os.environ.get("BM25_K1", 1.2))
+BM25_B = float(os.environ.get("BM25_B", 0.75))
+
+# 连续的汉字切成字二元组，字母与数字按词切分
+_TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for run in _TOKEN_PATTERN.findall((text or "").lower()):
+        if run[0] >= "\u4e00":
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+class LexicalIndex:
+    # BM25 倒排索引，按词项存为 CSR：词项 t 的倒排表为 indices[indptr[t]:indptr[t + 1]]，对应的词频在 tf 中
+    def __init__(
+            self,
+            doc_ids: np.ndarray,
+            vocab: np.ndarray,
+            indptr: np.ndarray,
+            indices: np.ndarray,
+            tf: np.ndarray,
+            doc_len: np.ndarray,
+    ):
+        self.doc_ids = doc_ids
+        self.vocab = vocab
+        self.indptr = indptr
+        self.indices = indices
+        self.tf = tf
+        self.doc_len = doc_len
+        self._term_ids = {term: i for i, term in enumerate(vocab.tolist())}
+        self._avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[str, str]]) -> "LexicalIndex":
+        doc_ids, doc_len = [], []
+        term_ids = {}
+        rows, cols, counts = [], [], []
+        for doc, (doc_id, text) in enumerate(documents):
+            tokens = Counter(tokenize(text))
+            doc_ids.append(doc_id)
+            doc_len.append(sum(tokens.values()))
+            for term, count in tokens.items():
+                rows.append(term_ids.setdefault(term, len(term_ids)))
+                cols.append(doc)
+                counts.append(count)
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.lexsort((np.asarray(cols, dtype=np.int64), rows))
+        indptr = np.zeros(len(term_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(term_ids)), out=indptr[1:])
+        return cls(
+            doc_ids=np.asarray(doc_ids, dtype=str),
+            vocab=np.asarray(list(term_ids), dtype=str),
+            indptr=indptr,
+            indices=np.asarray(cols, dtype=np.int32)[order],
+            tf=np.minimum(np.asarray(counts, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            doc_len=np.asarray(doc_len, dtype=np.int32),
+        )
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.part"
+        with open(temp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                doc_ids=self.doc_ids,
+                vocab=self.vocab,
+                indptr=self.indptr,
+                indices=self.indices,
+                tf=self.tf,
+                doc_len=self.doc_len,
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def search(self, query: str, limit: int) -> List[Tuple[str, float]]:
+        if not len(self.doc_ids):
+            return []
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            t = self._term_ids.get(term)
+            if t is None:
+                continue
+            matched = True
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs = self.indices[start:end]
+            tf = self.tf[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (len(self.doc_ids) - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[docs] / self._avg_len)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if not matched:
+            return []
+        return [
+            (str(self.doc_ids[i]), float(scores[i]))
+            for i in top_k(scores, limit) if scores[i] > 0
+        ]
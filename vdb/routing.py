@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from vdb.index import top_k
+
+# 检索时先把查询路由到最接近的若干个大纲小节，再只在这些小节的视频中做向量检索
+OUTLINE_ROUTE_SECTIONS = int(os.environ.get("OUTLINE_ROUTE_SECTIONS", 3))
+
+
+def outline_sections(outlines: Dict[str, List[str]]) -> List[Tuple[str, str]]:
+    # load_outlines 的结果展开为 (章, 节)；没有小节的章整体作为一个小节
+    sections = []
+    for chapter, items in outlines.items():
+        sections.extend((chapter, item) for item in items or [""])
+    return sections
+
+
+def section_key(chapter: str, section: str) -> str:
+    # 不同章中可能有同名小节，过滤字段中使用 “章/节”
+    return f"{chapter}/{section}" if section else chapter
+
+
+def section_text(chapter: str, section: str) -> str:
+    # 小节的标签文本，嵌入后用于入库时把视频分配到小节
+    return f"{chapter} {section}".strip()
+
+
+def outline_hash(outlines: Dict[str, List[str]]) -> str:
+    return hashlib.md5(json.dumps(outlines, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class OutlineRouter:
+    # 每个小节的标签向量与质心（分配到该小节的视频向量的均值，没有视频时为标签向量），
+    # 以及 校验和 -> 小节 的对应关系；与词法索引一样保存为 npz，由写入向量的进程重建
+    def __init__(
+            self,
+            outline_hash: str,
+            keys: np.ndarray,
+            chapters: np.ndarray,
+            labels: np.ndarray,
+            centroids: np.ndarray,
+            checksums: np.ndarray,
+            members: np.ndarray,
+    ):
+        self.outline_hash = str(outline_hash)
+        self.keys = keys
+        self.chapters = chapters
+        self.labels = labels
+        self.centroids = centroids
+        self.checksums = checksums
+        self.members = members
+        self._sections = dict(zip(checksums.tolist(), members.tolist()))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @staticmethod
+    def assign(labels: np.ndarray, vectors) -> np.ndarray:
+        # 每个视频分配到标签向量最接近的小节
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, labels.shape[1]))
+        return np.argmax(vectors @ _normalize(labels).T, axis=1)
+
+    @classmethod
+    def build(
+            cls,
+            outlines: Dict[str, List[str]],
+            labels: np.ndarray,
+            documents: Iterable[Tuple[str, str, np.ndarray]],
+    ) -> "OutlineRouter":
+        # documents 为 (校验和, 小节键, 向量)
+        sections = outline_sections(outlines)
+        keys = [section_key(chapter, section) for chapter, section in sections]
+        positions = {key: i for i, key in enumerate(keys)}
+        sums = np.zeros_like(labels, dtype=np.float32)
+        counts = np.zeros(len(keys), dtype=np.int64)
+        checksums, members = [], []
+        for checksum, key, vector in documents:
+            if key not in positions:
+                continue
+            section = positions[key]
+            sums[section] += _normalize(np.asarray(vector, dtype=np.float32))
+            counts[section] += 1
+            checksums.append(checksum)
+            members.append(section)
+        centroids = np.where(counts[:, None] > 0, sums, _normalize(labels))
+        return cls(
+            outline_hash=outline_hash(outlines),
+            keys=np.asarray(keys, dtype=str),
+            chapters=np.asarray([chapter for chapter, _ in sections], dtype=str),
+            labels=np.asarray(labels, dtype=np.float32),
+            centroids=_normalize(centroids).astype(np.float32),
+            checksums=np.asarray(checksums, dtype=str),
+            members=np.asarray(members, dtype=np.int32),
+        )
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.part"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                outline_hash=np.asarray(self.outline_hash),
+                keys=self.keys,
+                chapters=self.chapters,
+                labels=self.labels,
+                centroids=self.centroids,
+                checksums=self.checksums,
+                members=self.members,
+            )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "OutlineRouter":
+        with np.load(path) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    def route(self, query_vectors, sections: int = OUTLINE_ROUTE_SECTIONS) -> List[List[str]]:
+        # 每个查询最接近的 sections 个小节（按质心的余弦相似度）
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.centroids.shape[1]))
+        scores = queries @ self.centroids.T
+        return [[str(self.keys[i]) for i in top_k(row, sections)] for row in scores]
+
+    def members_of(self, keys: List[str]) -> List[str]:
+        # 属于这些小节的视频的校验和
+        wanted = np.isin(self.keys, keys)
+        return self.checksums[wanted[self.members]].tolist()
+
+    def section_of(self, checksum: str) -> Optional[Dict[str, str]]:
+        section = self._sections.get(checksum)
+        if section is None:
+            return None
+        return {"chapter": str(self.chapters[section]), "outline_section": str(self.keys[section])}
@@ -1,60 +1,351 @@
+import asyncio
 import hashlib
+import json
 import os
-import shutil
+import threading
 import uuid
-from typing import List, Dict, Any, Callable
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
-from ai_services.embedding import OpenAIEmbeddingService
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional
+
+import numpy as np
+from tenacity import Retrying, stop_after_attempt, wait_fixed
+from ai_services.asr import join_texts
+from ai_services.embedding import create_embedding_service, EMBEDDING_PROVIDER
+from ai_services.microbatch import EmbeddingMicroBatcher
+from data_utils.outline import load_outlines_from_file
+from vdb.doc_store import DocStore
+from vdb.index import VectorIndex, create_vector_index, VECTOR_PREFIX_DIM, VECTOR_QUANTIZE
+from vdb.lexical import LexicalIndex
+from vdb.routing import OutlineRouter, outline_hash, outline_sections, section_key, section_text
+from vdb.versions import IndexVersions
+
+# 分段级索引：把相邻的若干个 Whisper 分段合并为一个窗口，每个窗口一个向量
+SEGMENT_WINDOW_SIZE = int(os.environ.get("SEGMENT_WINDOW_SIZE", 6))
+SEGMENT_WINDOW_STRIDE = int(os.environ.get("SEGMENT_WINDOW_STRIDE", 3))
+# 分段检索时多取的候选数（按视频分组前）
+SEGMENT_SEARCH_OVERSAMPLE = int(os.environ.get("SEGMENT_SEARCH_OVERSAMPLE", 8))
+# 开启后，并发检索的查询向量合并为批量请求
+EMBEDDING_MICROBATCH = os.environ.get("EMBEDDING_MICROBATCH", "false").lower() in ("1", "true", "yes")
+# 向量索引后端：qdrant（Qdrant 本地模式）或 flat（内存映射的 NumPy 矩阵，支持多个只读进程同时打开）
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "qdrant").lower()
+# 混合检索：BM25（转写文本与摘要的汉字二元组）与向量检索的结果按 RRF 融合
+LEXICAL_INDEX = os.environ.get("LEXICAL_INDEX", "true").lower() in ("1", "true", "yes")
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", 50))
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", 60))
+# 词法一路在融合中的权重，大于 1 时更偏向精确命中术语的视频
+HYBRID_LEXICAL_WEIGHT = float(os.environ.get("HYBRID_LEXICAL_WEIGHT", 1.0))
+# 多关键字检索时按视频融合各关键字的结果：max（取最高相似度）、sum（相似度求和）或 rrf（倒数排名求和）
+KEYWORD_FUSION = os.environ.get("KEYWORD_FUSION", "max").lower()
+# 版本化索引的根目录（WORKING_DIR 下），没有 CURRENT 指针时使用旧的固定目录 INDEX_DIRS
+INDEX_ROOT = "indexes"
+# 不放进向量载荷、单独压缩存放的大字段，只在检索时显式请求才读取
+DOC_STORE_FIELDS = [field.strip() for field in os.environ.get("DOC_STORE_FIELDS", "transcript").split(",") if field.strip()]
+INDEX_DIRS = {
+    "qdrant": "qdrant_data",
+    "flat": "flat_index",
+}
+# 索引目录中记录建立索引时的嵌入后端、模型与维度，与当前配置不一致的索引不能打开
+EMBEDDING_INFO_FILE = "embedding.json"
+# 入库时每批嵌入并写入的文档数、同时在嵌入的批数，以及每批失败后的重试次数
+ADD_BATCH_SIZE = int(os.environ.get("ADD_BATCH_SIZE", 64))
+ADD_CONCURRENCY = int(os.environ.get("ADD_CONCURRENCY", 1))
+ADD_BATCH_RETRIES = int(os.environ.get("ADD_BATCH_RETRIES", 3))
+# 教材大纲文件（data_utils.outline 的格式）：设置后入库时把每个视频分配到大纲小节（载荷中的 chapter / outline_section），
+# 并为每个小节计算质心；检索时先路由到最接近的小节，再只在这些小节中做向量检索
+OUTLINE_FILE = os.environ.get("OUTLINE_FILE", "")
+
+
+class EmbeddingMismatchError(ValueError):
+    # 索引中的向量与当前嵌入配置产生的查询向量不在同一空间，需要全量重建
+    pass
+
+
+class _IndexBundle:
+    # 一个索引版本打开后的全部对象（向量索引、外部文档库、词法与路由索引）。切换版本时先完整打开新的一组，
+    # 再一次赋值替换；检索开始时取一次引用，整个检索都使用同一个版本的对象
+    def __init__(self, version: str, backend: str, path: str, collection_name: str):
+        self.version = version
+        self.backend = backend
+        self.path = path
+        self.index = create_vector_index(backend, path)
+        self.doc_store = DocStore(os.path.join(path, "docs", collection_name))
+        self.lexical_path = os.path.join(path, "lexical", f"{collection_name}.npz")
+        self.checkpoint_path = os.path.join(path, "checkpoints", f"{collection_name}.json")
+        self.routing_path = os.path.join(path, "routing", f"{collection_name}.npz")
+        # (文件状态, 已加载的对象)，文件被其他进程重建时重新加载；成对赋值，并发读取时不会拿到不匹配的一对
+        self.lexical = (None, None)
+        self.router = (None, None)
+
+    @staticmethod
+    def _reload(path: str, loaded: tuple, load: Callable):
+        try:
+            stat = os.stat(path)
+            stat = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None, None
+        if stat == loaded[0]:
+            return loaded
+        return stat, load(path)
+
+    def load_lexical(self) -> Optional[LexicalIndex]:
+        self.lexical = self._reload(self.lexical_path, self.lexical, LexicalIndex.load)
+        return self.lexical[1]
+
+    def load_router(self) -> Optional[OutlineRouter]:
+        self.router = self._reload(self.routing_path, self.router, OutlineRouter.load)
+        return self.router[1]
+
+
+def fuse_result_lists(results_per_query: List[List[Dict[str, Any]]], top_k: int, method: str = KEYWORD_FUSION):
+    # 与查询的先后顺序无关：同分时按视频的校验和排序；每个视频保留相似度最高的一条结果（及其片段时间点）
+    if method not in ("max", "sum", "rrf"):
+        raise ValueError(f"不支持的融合方式: {method}")
+    fused = {}
+    best = {}
+    for results in results_per_query:
+        for rank, result in enumerate(results):
+            key = result['metadata'].get('checksum') or result['text']
+            if method == "max":
+                fused[key] = max(fused.get(key, float("-inf")), result['score'])
+            elif method == "sum":
+                fused[key] = fused.get(key, 0.0) + result['score']
+            else:
+                fused[key] = fused.get(key, 0.0) + 1 / (HYBRID_RRF_K + rank + 1)
+            if key not in best or result['score'] > best[key]['score']:
+                best[key] = result
+    ranked = sorted(fused, key=lambda key: (-fused[key], key))[:top_k]
+    return [{**best[key], 'fusion_score': fused[key]} for key in ranked]
+
+
+def build_segment_windows(
+        segments: List[Dict[str, Any]],
+        window_size: int = SEGMENT_WINDOW_SIZE,
+        stride: int = SEGMENT_WINDOW_STRIDE,
+) -> List[Dict[str, Any]]:
+    windows = []
+    if not segments:
+        return windows
+    window_size = max(1, window_size)
+    stride = max(1, min(stride, window_size))
+    for start in range(0, max(1, len(segments) - window_size + stride), stride):
+        window = segments[start:start + window_size]
+        if not window:
+            break
+        windows.append({
+            "start": window[0]["start"],
+            "end": window[-1]["end"],
+            "text": join_texts([segment["text"] for segment in window]),
+        })
+    return windows
 
 
 class VectorStore:
     def __init__(
             self,
             collection_name: str,
+            segment_index: bool = None,
+            backend: str = VECTOR_BACKEND,
+            lexical_index: bool = LEXICAL_INDEX,
+            path: str = None,
+            outline_file: str = OUTLINE_FILE,
     ):
         working_dir = os.environ.get("WORKING_DIR")
         self._collection_name = collection_name
-        self._path = os.path.join(working_dir, "qdrant_data")
-        self._client = QdrantClient(path=self._path)
-        embedding_model = os.environ.get("EMBEDDING_MODEL")
-        if not embedding_model:
-            raise ValueError("请提供嵌入模型")
-        if os.environ.get("EMBEDDING_DIMENSION"):
-            self._vector_size = int(os.environ.get("EMBEDDING_DIMENSION"))
-        self._embedding_function = OpenAIEmbeddingService(
-            model=embedding_model,
-            dimensions=self._vector_size
-        ).embed
+        # 分段级索引存放在单独的集合中，检索时按视频分组并返回最匹配的时间点
+        if segment_index is None:
+            segment_index = os.environ.get("SEGMENT_INDEX", "false").lower() in ("1", "true", "yes")
+        self._segment_index = segment_index
+        self._segment_collection_name = f"{collection_name}_segments"
+        if backend not in INDEX_DIRS:
+            raise ValueError(f"不支持的向量索引后端: {backend}")
+        # 词法索引与向量索引放在同一目录，由写入向量的进程在入库时重建
+        self._lexical_enabled = lexical_index
+        self._outlines = load_outlines_from_file(outline_file) if outline_file else None
+        self._section_labels_cache = None
+        # 嵌入后端由 EMBEDDING_PROVIDER 选择（openai / hashing）
+        dimension = os.environ.get("EMBEDDING_DIMENSION")
+        self._embedding_provider = EMBEDDING_PROVIDER
+        self._embedding_service = create_embedding_service(
+            provider=self._embedding_provider,
+            model=os.environ.get("EMBEDDING_MODEL"),
+            dimensions=int(dimension) if dimension else None,
+        )
+        self._embedding_model = self._embedding_service.model_name
+        self._vector_size = self._embedding_service.dimensions
+        if not self._vector_size:
+            raise ValueError("请提供向量维度 EMBEDDING_DIMENSION")
+        self._embedding_function = self._embedding_service.embed
+        self._query_batcher = EmbeddingMicroBatcher(self._embedding_service) if EMBEDDING_MICROBATCH else None
+
+        # 未指定目录时打开 CURRENT 指向的版本，并在检索时跟随指针的切换
+        self._open_lock = threading.Lock()
+        self._versions = None
+        self._pointer_stat = None
+        version = None
+        if path is None:
+            self._versions = IndexVersions(os.path.join(working_dir, INDEX_ROOT))
+            self._pointer_stat = self._versions.pointer_stat()
+            if (pointer := self._versions.current()) is not None:
+                version = pointer["version"]
+                backend = pointer["backend"]
+                path = self._versions.path(version)
+            else:
+                path = os.path.join(working_dir, INDEX_DIRS[backend])
+        if backend != "flat" and (VECTOR_PREFIX_DIM or VECTOR_QUANTIZE):
+            # Qdrant 本地模式始终精确检索，开启了也不会生效
+            raise ValueError(f"VECTOR_PREFIX_DIM / VECTOR_QUANTIZE 只支持 flat 后端，当前索引后端为 {backend}")
+        self._bundle = self._open(version, backend, path)
 
+    def _open(self, version: Optional[str], backend: str, path: str) -> _IndexBundle:
+        self._check_embedding(path)
+        bundle = _IndexBundle(version, backend, path, self._collection_name)
         # 确保集合存在
-        self._create_collection_if_not_exists()
-
-    def _create_collection_if_not_exists(self):
-        collections = self._client.get_collections().collections
-        if not any(collection.name == self._collection_name for collection in collections):
-            self._client.create_collection(
-                collection_name=self._collection_name,
-                vectors_config=models.VectorParams(
-                    size=self._vector_size, distance=models.Distance.COSINE
-                ),
-                optimizers_config=models.OptimizersConfigDiff(
-                    indexing_threshold=0,  # 即时索引
-                ),
-                hnsw_config=models.HnswConfigDiff(
-                    m=16,
-                    ef_construct=100,
-                    full_scan_threshold=10000,
-                ),
-                wal_config=models.WalConfigDiff(
-                    wal_capacity_mb=32,
-                ),
-                shard_number=1,
-                on_disk_payload=True,
+        self._create_collections(bundle.index)
+        return bundle
+
+    def check_version(self) -> str:
+        # 索引重建完成并切换 CURRENT 后重新打开新版本：新版本的全部对象打开后一次赋值发布，
+        # 检索线程要么拿到旧版本的一组对象，要么拿到新版本的；旧版本的对象交给垃圾回收，
+        # 以免关闭时影响其他线程中正在进行的检索
+        if self._versions is None:
+            return self._bundle.version
+        stat = self._versions.pointer_stat()
+        if stat == self._pointer_stat:
+            return self._bundle.version
+        with self._open_lock:
+            if stat != self._pointer_stat:
+                pointer = self._versions.current()
+                if pointer is not None and pointer["version"] != self._bundle.version:
+                    try:
+                        bundle = self._open(pointer["version"], pointer["backend"], self._versions.path(pointer["version"]))
+                    except EmbeddingMismatchError as e:
+                        # 新版本由不同的嵌入配置建立，继续使用当前版本，重启后按新配置打开
+                        print(f"未切换索引版本 {pointer['version']}: {e}")
+                    else:
+                        self._bundle = bundle
+                        print(f"已切换到索引版本 {bundle.version}")
+                self._pointer_stat = stat
+        return self._bundle.version
+
+    def _snapshot(self) -> _IndexBundle:
+        # 检索开始时取一次当前版本，之后的每一步都使用这一组对象
+        self.check_version()
+        return self._bundle
+
+    @property
+    def version(self) -> str:
+        return self._bundle.version
+
+    @property
+    def path(self) -> str:
+        return self._bundle.path
+
+    @property
+    def segment_index(self) -> bool:
+        return self._segment_index
+
+    def _create_collections(self, index: VectorIndex):
+        self._create_collection_if_not_exists(index, self._collection_name)
+        index.create_field_index(self._collection_name, 'checksum')
+        if self._outlines is not None:
+            index.create_field_index(self._collection_name, 'outline_section')
+            index.create_field_index(self._collection_name, 'chapter')
+        if self._segment_index:
+            self._create_collection_if_not_exists(index, self._segment_collection_name)
+            index.create_field_index(self._segment_collection_name, 'checksum')
+
+    def _create_collection_if_not_exists(self, index: VectorIndex, collection_name: str):
+        index.ensure_collection(collection_name, self._vector_size)
+
+    @property
+    def backend(self) -> str:
+        return self._bundle.backend
+
+    @property
+    def embedding_model(self) -> str:
+        return self._embedding_model
+
+    @property
+    def embedding_provider(self) -> str:
+        return self._embedding_provider
+
+    @property
+    def vector_size(self) -> int:
+        return self._vector_size
+
+    @property
+    def embedding_info(self) -> Dict[str, Any]:
+        return {
+            "provider": self._embedding_provider,
+            "model": self._embedding_model,
+            "dimensions": self._vector_size,
+        }
+
+    def _check_embedding(self, path: str):
+        # 升级前建立的索引没有记录，不做检查，下次写入时补上
+        try:
+            with open(os.path.join(path, EMBEDDING_INFO_FILE), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        if stored != self.embedding_info:
+            raise EmbeddingMismatchError(
+                f"索引 {path} 使用的嵌入 {stored} 与当前配置 {self.embedding_info} 不一致，请全量重建索引"
             )
 
+    def _record_embedding(self):
+        # 写入向量前记录；只读进程不会在索引目录中写入任何东西
+        path = os.path.join(self._bundle.path, EMBEDDING_INFO_FILE)
+        if os.path.exists(path):
+            return
+        os.makedirs(self._bundle.path, exist_ok=True)
+        temp_path = f"{path}.part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.embedding_info, f)
+        os.replace(temp_path, path)
+
     def set_embedding_function(self, embedding_function: Callable):
         self._embedding_function = embedding_function
+        self._embedding_service = None
+        self._query_batcher = None
+
+    def query_batch_stats(self) -> dict:
+        return self._query_batcher.stats() if self._query_batcher is not None else {}
+
+    def _embed_query(self, query: str) -> List[float]:
+        if self._query_batcher is not None:
+            return self._query_batcher.embed(query)[0].tolist()
+        return self.embed([query])[0].tolist()
+
+    async def _aembed_query(self, query: str) -> List[float]:
+        if self._query_batcher is not None:
+            return (await self._query_batcher.aembed(query))[0].tolist()
+        return (await self.aembed([query]))[0].tolist()
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        if self._query_batcher is not None:
+            return self._query_batcher.embed(queries)
+        return self.embed(queries)
+
+    async def _aembed_queries(self, queries: List[str]) -> np.ndarray:
+        if self._query_batcher is not None:
+            return await self._query_batcher.aembed(queries)
+        return await self.aembed(queries)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not self._embedding_function:
+            raise ValueError("请先设置嵌入函数")
+        # 统一为 float32 矩阵，兼容通过 set_embedding_function 设置的返回列表的函数
+        return np.asarray(self._embedding_function(texts), dtype=np.float32)
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        if not self._embedding_function:
+            raise ValueError("请先设置嵌入函数")
+        # 自定义的嵌入函数没有异步版本，放到线程中执行
+        if self._embedding_service is None:
+            return await asyncio.to_thread(self.embed, texts)
+        return await self._embedding_service.aembed(texts)
 
     @staticmethod
     def _generate_unique_id(input_string: str) -> str:
@@ -68,64 +359,571 @@ class VectorStore:
 
         return str(generated_uuid)
 
-    def add_documents(self, documents: List[Dict[str, Any]]):
-        try:
-            self._add_documents(documents)
-        except Exception as e:
-            print(f"清空当前库并重新添加文档: {e}")
-            # force delete self._path
-            shutil.rmtree(self._path)
-            self._client = QdrantClient(path=self._path)
-            self._create_collection_if_not_exists()
-            self._add_documents(documents)
-
-    def _add_documents(self, documents: List[Dict[str, Any]]):
+    def add_documents(
+            self,
+            documents: Iterable[Dict[str, Any]],
+            batch_size: int = ADD_BATCH_SIZE,
+            concurrency: int = ADD_CONCURRENCY,
+    ) -> int:
+        # 流式入库：按 batch_size 分批嵌入并写入，内存占用只与批大小有关。最多 concurrency 批同时在嵌入，
+        # 写入按顺序在当前线程进行（索引只有一个写者）。每批写入后更新检查点；某批重试后仍失败时抛出异常，
+        # 已写入的批次保留，再次调用时跳过检查点中已写入的文档
         if not self._embedding_function:
             raise ValueError("请先设置嵌入函数")
-        points = []
-        texts = [doc['text'] for doc in documents]
-        vectors = self._embedding_function(texts)
-        for i, doc in enumerate(documents):
+        concurrency = max(1, concurrency)
+        self._record_embedding()
+        checkpoint = self._load_checkpoint()
+        done = set(checkpoint["ids"])
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for batch in self._document_batches(documents, batch_size, done):
+                pending.append((batch, executor.submit(self._retry, self._embed_documents, batch)))
+                if len(pending) >= concurrency:
+                    self._write_batch(*pending.popleft(), checkpoint)
+            while pending:
+                self._write_batch(*pending.popleft(), checkpoint)
+        self.rebuild_lexical_index()
+        self.rebuild_routing_index()
+        self._clear_checkpoint()
+        return checkpoint["documents"]
+
+    def _document_id(self, doc: Dict[str, Any]) -> str:
+        if "checksum" in doc['metadata']:
+            return self._generate_unique_id(doc['metadata']['checksum'])
+        return self._generate_unique_id(doc['text'])
+
+    def _document_batches(self, documents: Iterable[Dict[str, Any]], batch_size: int, done: set) -> Iterator[list]:
+        batch = []
+        for doc in documents:
+            if self._document_id(doc) in done:
+                continue
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _retry(function: Callable, *args):
+        # 嵌入服务内部已重试网络错误，这里整批重试（包括写入索引时的错误）；写入按 id 覆盖，重复执行没有副作用
+        retrying = Retrying(stop=stop_after_attempt(max(1, ADD_BATCH_RETRIES)), wait=wait_fixed(1), reraise=True)
+        for attempt in retrying:
+            with attempt:
+                return function(*args)
+
+    def _embed_documents(self, documents: List[Dict[str, Any]]) -> list:
+        # 已携带预先计算的向量（doc['vector']）的文档不再重复嵌入
+        vectors = [doc.get('vector') for doc in documents]
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing:
+            embedded = self.embed([documents[i]['text'] for i in missing])
+            for i, vec in zip(missing, embedded):
+                vectors[i] = vec.tolist()
+        return vectors
+
+    def _write_batch(self, documents: List[Dict[str, Any]], vectors, checkpoint: dict):
+        self._retry(self._upsert_documents, documents, vectors.result())
+        checkpoint["ids"].extend(self._document_id(doc) for doc in documents)
+        checkpoint["batches"] += 1
+        checkpoint["documents"] += len(documents)
+        self._save_checkpoint(checkpoint)
+        print(f"已写入 {checkpoint['documents']} 个文档")
+
+    def _upsert_documents(self, documents: List[Dict[str, Any]], vectors: list):
+        ids = []
+        payloads = []
+        external = {}
+        sections = self._assign_sections(vectors) if self._outlines is not None else [{}] * len(documents)
+        for doc, section in zip(documents, sections):
+            _uuid = self._document_id(doc)
             if "checksum" in doc['metadata']:
-                _uuid = self._generate_unique_id(doc['metadata']['checksum'])
+                # 大字段写入外部文档库，向量载荷中只保留检索结果需要的小字段
+                payload = {k: v for k, v in doc['metadata'].items() if k not in DOC_STORE_FIELDS}
+                external[_uuid] = {k: v for k, v in doc['metadata'].items() if k in DOC_STORE_FIELDS}
             else:
-                _uuid = self._generate_unique_id(doc['text'])
-            point = models.PointStruct(
-                id=_uuid,
-                vector=vectors[i],
-                payload={
-                    'text': doc['text'],
-                    **doc['metadata']
+                payload = doc['metadata']
+            ids.append(_uuid)
+            payloads.append({
+                'text': doc['text'],
+                **payload,
+                **section,
+            })
+
+        self._bundle.doc_store.put_many({k: v for k, v in external.items() if v})
+        self._bundle.index.upsert(self._collection_name, ids, vectors, payloads)
+        if self._segment_index:
+            self.add_segments(documents)
+
+    def _load_checkpoint(self) -> dict:
+        # 检查点只在入库中途失败时存在：{"batches": 已写入批数, "documents": 已写入文档数, "ids": 已写入的 id}
+        try:
+            with open(self._bundle.checkpoint_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"batches": 0, "documents": 0, "ids": []}
+
+    def _save_checkpoint(self, checkpoint: dict):
+        os.makedirs(os.path.dirname(self._bundle.checkpoint_path), exist_ok=True)
+        temp_path = f"{self._bundle.checkpoint_path}.part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, self._bundle.checkpoint_path)
+
+    def _clear_checkpoint(self):
+        try:
+            os.remove(self._bundle.checkpoint_path)
+        except FileNotFoundError:
+            pass
+
+    def add_segments(self, documents: List[Dict[str, Any]]):
+        # 每个视频的分段窗口单独嵌入并写入分段集合，写入前先删除该视频旧的分段
+        self._record_embedding()
+        for doc in documents:
+            checksum = doc['metadata'].get('checksum')
+            windows = build_segment_windows(doc.get('segments') or [])
+            if not checksum or not windows:
+                continue
+            self._bundle.index.delete(self._segment_collection_name, where={'checksum': [checksum]})
+            vectors = self.embed([window['text'] for window in windows])
+            payloads = [
+                {
+                    'checksum': checksum,
+                    'title': doc['metadata'].get('title'),
+                    'source_url': doc['metadata'].get('source_url'),
+                    'display_text': doc['metadata'].get('display_text', doc['text']),
+                    'segment_text': window['text'],
+                    'start': window['start'],
+                    'end': window['end'],
                 }
+                for window in windows
+            ]
+            self._bundle.index.upsert(
+                self._segment_collection_name,
+                [self._generate_unique_id(f"{checksum}_{i}") for i in range(len(windows))],
+                vectors,
+                payloads,
             )
-            points.append(point)
 
-        self._client.upsert(collection_name=self._collection_name, points=points)
+    def get_stored_checksums(self, segments: bool = False) -> Dict[str, Dict[str, Any]]:
+        # 读取集合中已有文档的校验和及其元数据（不读取向量）
+        stored = {}
+        for _, payload in self._bundle.index.scroll(
+                self._segment_collection_name if segments else self._collection_name,
+                fields=["checksum", "source_url", "title"],
+        ):
+            checksum = payload.get("checksum")
+            if checksum:
+                stored[checksum] = payload
+        return stored
+
+    def delete_documents(self, checksums: List[str]):
+        if not checksums:
+            return
+        ids = [self._generate_unique_id(checksum) for checksum in checksums]
+        self._bundle.index.delete(self._collection_name, ids=ids)
+        self._bundle.doc_store.delete_many(ids)
+        if self._segment_index:
+            self._bundle.index.delete(self._segment_collection_name, where={'checksum': list(checksums)})
+        self.rebuild_lexical_index()
+        self.rebuild_routing_index()
+
+    def rebuild_lexical_index(self):
+        # BM25 的 idf 依赖整个语料，增删文档后整体重建；只读取文本字段，不读取向量
+        if not self._lexical_enabled:
+            return
+        ids, payloads = [], []
+        for _id, payload in self._bundle.index.scroll(
+                self._collection_name, fields=['checksum', 'text', 'display_text', 'transcript']
+        ):
+            if payload.get('checksum'):
+                ids.append(_id)
+                payloads.append(payload)
+        # 转写文本在外部文档库中（旧版本的索引仍在载荷中）
+        external = self._bundle.doc_store.get_many(ids)
+        documents = []
+        for payload, doc in zip(payloads, external):
+            display_text = payload.get('display_text') or payload.get('text', '')
+            transcript = payload.get('transcript') or (doc or {}).get('transcript', '')
+            documents.append((payload['checksum'], f"{display_text}\n{transcript}"))
+        LexicalIndex.build(documents).save(self._bundle.lexical_path)
 
-    def search(self, query: str, top_k: int = 5):
+    def ensure_lexical_index(self) -> bool:
+        # 升级前建立的索引还没有词法索引；上次入库中途失败（留有检查点）时词法索引也没有更新
+        interrupted = os.path.exists(self._bundle.checkpoint_path)
+        if interrupted or (self._lexical_enabled and not os.path.exists(self._bundle.lexical_path)):
+            self.rebuild_lexical_index()
+            self._clear_checkpoint()
+            return True
+        return False
+
+    def _section_labels(self) -> np.ndarray:
+        # 小节标签向量：保存在路由索引中，大纲变化后重新嵌入
+        router = self._load_router(self._bundle)
+        if router is not None and router.outline_hash == outline_hash(self._outlines):
+            return router.labels
+        if self._section_labels_cache is None:
+            self._section_labels_cache = self.embed([
+                section_text(chapter, section) for chapter, section in outline_sections(self._outlines)
+            ])
+        return self._section_labels_cache
+
+    def _assign_sections(self, vectors) -> List[Dict[str, str]]:
+        sections = outline_sections(self._outlines)
+        return [
+            {'chapter': sections[i][0], 'outline_section': section_key(*sections[i])}
+            for i in OutlineRouter.assign(self._section_labels(), vectors)
+        ]
+
+    def rebuild_routing_index(self):
+        # 小节质心依赖所有视频的向量，与词法索引一样在增删文档后整体重建
+        if self._outlines is None:
+            return
+        labels = self._section_labels()
+        documents = (
+            (payload['checksum'], payload.get('outline_section'), vector)
+            for _, payload, vector in self._bundle.index.scroll_vectors(
+                self._collection_name, fields=['checksum', 'outline_section']
+            )
+            if payload.get('checksum')
+        )
+        OutlineRouter.build(self._outlines, labels, documents).save(self._bundle.routing_path)
+
+    def ensure_outline_sections(self) -> int:
+        # 为还没有分配小节的视频（设置大纲前入库的）补充分配；大纲文件变化后全部重新分配
+        if self._outlines is None:
+            return 0
+        router = self._load_router(self._bundle)
+        changed = router is not None and router.outline_hash != outline_hash(self._outlines)
+        keys = {section_key(chapter, section) for chapter, section in outline_sections(self._outlines)}
+        pending_ids, pending_vectors = [], []
+        for _id, payload, vector in self._bundle.index.scroll_vectors(
+                self._collection_name, fields=['checksum', 'outline_section']
+        ):
+            if payload.get('checksum') and (changed or payload.get('outline_section') not in keys):
+                pending_ids.append(_id)
+                pending_vectors.append(vector)
+        if pending_ids:
+            groups = {}
+            for _id, section in zip(pending_ids, self._assign_sections(np.asarray(pending_vectors))):
+                groups.setdefault(section['outline_section'], (section, []))[1].append(_id)
+            for section, ids in groups.values():
+                self._bundle.index.set_payload(self._collection_name, section, ids=ids)
+            print(f"分配大纲小节 {len(pending_ids)} 个")
+        if pending_ids or router is None or changed:
+            self.rebuild_routing_index()
+            return len(pending_ids) or 1
+        return 0
+
+    def _load_router(self, bundle: _IndexBundle) -> Optional[OutlineRouter]:
+        if self._outlines is None:
+            return None
+        return bundle.load_router()
+
+    def _lexical_search(self, bundle: _IndexBundle, query: str, limit: int) -> List[tuple]:
+        if not self._lexical_enabled:
+            return []
+        lexical = bundle.load_lexical()
+        return lexical.search(query, limit) if lexical is not None else []
+
+    def update_metadata(self, checksum: str, metadata: Dict[str, Any]):
+        # 只更新元数据，不重新计算向量（例如视频文件被移动或改名）
+        self._bundle.index.set_payload(
+            self._collection_name,
+            metadata,
+            ids=[self._generate_unique_id(checksum)],
+        )
+        if self._segment_index:
+            self._bundle.index.set_payload(self._segment_collection_name, metadata, where={'checksum': [checksum]})
+
+    def search(self, query: str, top_k: int = 5, fields: List[str] = None):
+        # fields 为结果 metadata 中需要的字段，None 表示向量载荷中的全部字段（不含外部文档库中的大字段）
+        if not self._embedding_function:
+            raise ValueError("请先设置嵌入函数")
+
+        query_vector = self._embed_query(query)
+        return self._hybrid_search(query, query_vector, top_k, fields)
+
+    async def asearch(self, query: str, top_k: int = 5, fields: List[str] = None):
+        query_vector = await self._aembed_query(query)
+        # 索引后端只有同步接口，放到线程中执行以免阻塞事件循环
+        return await asyncio.to_thread(self._hybrid_search, query, query_vector, top_k, fields)
+
+    def search_batch(
+            self,
+            queries: List[str],
+            top_k: int = 5,
+            fusion: str = KEYWORD_FUSION,
+            fields: List[str] = None,
+    ):
+        # 多个关键字：一次嵌入请求、一次批量检索，再按视频融合
+        if not self._embedding_function:
+            raise ValueError("请先设置嵌入函数")
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return []
+        query_vectors = self._embed_queries(queries)
+        return self._search_batch(queries, query_vectors, top_k, fusion, fields)
+
+    async def asearch_batch(
+            self,
+            queries: List[str],
+            top_k: int = 5,
+            fusion: str = KEYWORD_FUSION,
+            fields: List[str] = None,
+    ):
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return []
+        query_vectors = await self._aembed_queries(queries)
+        return await asyncio.to_thread(self._search_batch, queries, query_vectors, top_k, fusion, fields)
+
+    def search_lists(self, queries: List[str], top_k: int = 5, fields: List[str] = None) -> List[List[dict]]:
+        # 每个关键字各自的排序结果（按视频融合之前），与 search_batch 内部的中间结果相同，用于预计算常用关键字
         if not self._embedding_function:
             raise ValueError("请先设置嵌入函数")
+        queries = list(dict.fromkeys(queries))
+        if not queries:
+            return []
+        return self._search_lists(self._snapshot(), queries, self._embed_queries(queries), top_k, fields)
+
+    def fuse_lists(
+            self,
+            results_per_query: List[List[dict]],
+            top_k: int = 5,
+            fusion: str = KEYWORD_FUSION,
+            fields: List[str] = None,
+    ):
+        # search_lists 的结果按视频融合，等同于 search_batch
+        return self._attach_external_fields(self._snapshot(), fuse_result_lists(results_per_query, top_k, fusion), fields)
+
+    def _search_batch(
+            self,
+            queries: List[str],
+            query_vectors: np.ndarray,
+            top_k: int,
+            fusion: str,
+            fields: List[str] = None,
+    ):
+        bundle = self._snapshot()
+        results_per_query = self._search_lists(bundle, queries, query_vectors, top_k, fields)
+        return self._attach_external_fields(bundle, fuse_result_lists(results_per_query, top_k, fusion), fields)
 
-        query_vector = self._embedding_function(query)
-        results = self._client.search(
-            collection_name=self._collection_name,
-            query_vector=query_vector[0],
-            limit=top_k
+    def _search_lists(
+            self,
+            bundle: _IndexBundle,
+            queries: List[str],
+            query_vectors: np.ndarray,
+            top_k: int,
+            fields: List[str] = None,
+    ):
+        limit = max(top_k, HYBRID_CANDIDATES) if self._lexical_enabled else top_k
+        dense_lists = self._search_routed(bundle, query_vectors, limit, fields)
+        results_per_query = []
+        for query, query_vector, dense in zip(queries, query_vectors, dense_lists):
+            lexical = self._lexical_search(bundle, query, limit)
+            results = self._fuse(bundle, dense, lexical, query_vector, limit, fields) if lexical else dense
+            results_per_query.append(self._attach_sections(bundle, results, fields))
+        return results_per_query
+
+    def _hybrid_search(self, query: str, query_vector: List[float], top_k: int, fields: List[str] = None):
+        bundle = self._snapshot()
+        lexical = self._lexical_search(bundle, query, max(top_k, HYBRID_CANDIDATES))
+        if not lexical:
+            results = self._search_routed(bundle, [query_vector], top_k, fields)[0]
+        else:
+            dense = self._search_routed(bundle, [query_vector], max(top_k, HYBRID_CANDIDATES), fields)[0]
+            results = self._fuse(bundle, dense, lexical, query_vector, top_k, fields)
+        return self._attach_external_fields(bundle, self._attach_sections(bundle, results, fields), fields)
+
+    def _search_routed(self, bundle: _IndexBundle, query_vectors, top_k: int, fields: List[str] = None):
+        # 有大纲时每个查询只检索路由到的小节（词法检索与融合补查仍覆盖全库）；路由到的小节中没有视频时检索全库
+        router = self._load_router(bundle)
+        if router is None or not len(router):
+            return self._search_by_vectors(bundle, query_vectors, top_k, fields=fields)
+        results = []
+        for query_vector, keys in zip(query_vectors, router.route(query_vectors)):
+            if self._segment_index:
+                # 分段集合中没有小节字段，按小节中的视频过滤
+                members = router.members_of(keys)
+                where = {'checksum': members} if members else None
+            else:
+                where = {'outline_section': keys}
+            hits = self._search_by_vector(bundle, query_vector, top_k, where, fields) if where else []
+            if not hits:
+                hits = self._search_by_vector(bundle, query_vector, top_k, fields=fields)
+            results.append(hits)
+        return results
+
+    def _attach_sections(self, bundle: _IndexBundle, results: List[dict], fields: List[str] = None) -> List[dict]:
+        # 分段检索的结果中没有小节字段，从路由索引中补上，用于按章节分面
+        router = self._load_router(bundle)
+        if router is None or (fields is not None and 'chapter' not in fields and 'outline_section' not in fields):
+            return results
+        for result in results:
+            if 'outline_section' in result['metadata']:
+                continue
+            section = router.section_of(result['metadata'].get('checksum', ''))
+            for key, value in (section or {}).items():
+                if fields is None or key in fields:
+                    result['metadata'][key] = value
+        return results
+
+    def _fuse(
+            self,
+            bundle: _IndexBundle,
+            dense: List[dict],
+            lexical: List[tuple],
+            query_vector: List[float],
+            top_k: int,
+            fields: List[str] = None,
+    ):
+        # 倒数排名融合：每个视频的得分为它在两路结果中 1 / (k + 名次) 之和
+        fused = {}
+        by_checksum = {}
+        for rank, result in enumerate(dense):
+            checksum = result['metadata'].get('checksum') or result['text']
+            by_checksum.setdefault(checksum, result)
+            fused[checksum] = fused.get(checksum, 0.0) + 1 / (HYBRID_RRF_K + rank + 1)
+        for rank, (checksum, _) in enumerate(lexical):
+            fused[checksum] = fused.get(checksum, 0.0) + HYBRID_LEXICAL_WEIGHT / (HYBRID_RRF_K + rank + 1)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        # 只被词法检索命中的视频补查一次向量得分，结果中的 score 仍为余弦相似度，阈值过滤的含义不变
+        missing = [checksum for checksum in ranked if checksum not in by_checksum]
+        if missing:
+            for result in self._search_by_vector(bundle, query_vector, len(missing), {'checksum': missing}, fields):
+                by_checksum.setdefault(result['metadata']['checksum'], result)
+        return [
+            {**by_checksum[checksum], 'fusion_score': fused[checksum]}
+            for checksum in ranked if checksum in by_checksum
+        ]
+
+    def _attach_external_fields(self, bundle: _IndexBundle, results: List[dict], fields: List[str] = None) -> List[dict]:
+        # 只有显式请求的大字段才从外部文档库中按需读取
+        wanted = [field for field in fields or [] if field in DOC_STORE_FIELDS]
+        if not wanted or not results:
+            return results
+        keys = [self._generate_unique_id(result['metadata'].get('checksum', '')) for result in results]
+        for result, doc in zip(results, bundle.doc_store.get_many(keys)):
+            # 融合后的结果与各关键字的结果共用 metadata，复制后再补充字段
+            result['metadata'] = {**result['metadata'], **{field: doc[field] for field in wanted if doc and field in doc}}
+        return results
+
+    def get_document_fields(self, checksum: str, fields: List[str] = None) -> Dict[str, Any]:
+        # 读取单个视频的大字段（如完整转写）
+        doc = self._snapshot().doc_store.get(self._generate_unique_id(checksum)) or {}
+        return {k: v for k, v in doc.items() if fields is None or k in fields}
+
+    @staticmethod
+    def _projection(fields: List[str], required: List[str]):
+        # 传给索引后端的载荷字段：请求的字段去掉外部大字段，再加上内部分组、融合需要的字段
+        if fields is None:
+            return None
+        return sorted((set(fields) - set(DOC_STORE_FIELDS)) | set(required))
+
+    def _search_by_vector(
+            self,
+            bundle: _IndexBundle,
+            query_vector: List[float],
+            top_k: int,
+            where: Dict[str, List[Any]] = None,
+            fields: List[str] = None,
+    ):
+        return self._search_by_vectors(bundle, [query_vector], top_k, where, fields)[0]
+
+    def _search_by_vectors(
+            self,
+            bundle: _IndexBundle,
+            query_vectors,
+            top_k: int,
+            where: Dict[str, List[Any]] = None,
+            fields: List[str] = None,
+    ):
+        videos = self._search_videos(bundle, query_vectors, top_k, where, fields)
+        if not self._segment_index:
+            return videos
+        # 没有分段的视频（无时间轴的转写）只在视频集合中，两个集合的结果按视频合并
+        segments = self._search_segments(bundle, query_vectors, top_k, where, fields)
+        return [self._merge_segment_hits(hits, video_hits, top_k) for hits, video_hits in zip(segments, videos)]
+
+    @staticmethod
+    def _merge_segment_hits(segments: List[dict], videos: List[dict], top_k: int) -> List[dict]:
+        # 同一视频取两者中较高的得分，有分段命中时保留分段的时间点；文本与分段结果一样使用摘要
+        merged = {}
+        for result in videos:
+            result = {**result, 'text': result['metadata'].get('display_text', result['text'])}
+            merged[result['metadata'].get('checksum') or result['text']] = result
+        for result in segments:
+            checksum = result['metadata']['checksum']
+            if checksum in merged:
+                result = {**result, 'score': max(result['score'], merged[checksum]['score'])}
+            merged[checksum] = result
+        return sorted(merged.values(), key=lambda result: result['score'], reverse=True)[:top_k]
+
+    def _search_videos(
+            self,
+            bundle: _IndexBundle,
+            query_vectors,
+            top_k: int,
+            where: Dict[str, List[Any]] = None,
+            fields: List[str] = None,
+    ):
+        required = ['text', 'checksum', 'display_text'] if self._segment_index else ['text', 'checksum']
+        results = bundle.index.search_batch(
+            self._collection_name, query_vectors, top_k, where=where,
+            fields=self._projection(fields, required),
         )
 
         return [
-            {
-                'text': hit.payload['text'],
-                'metadata': {
-                    k: v for k, v in hit.payload.items() if k != 'text'
-                },
-                'score': hit.score
-            } for hit in results
+            [
+                {
+                    'text': hit.payload['text'],
+                    'metadata': {
+                        k: v for k, v in hit.payload.items() if k != 'text'
+                    },
+                    'score': hit.score
+                } for hit in hits
+            ] for hits in results
         ]
 
+    def _search_segments(
+            self,
+            bundle: _IndexBundle,
+            query_vectors,
+            top_k: int,
+            where: Dict[str, List[Any]] = None,
+            fields: List[str] = None,
+    ):
+        # 多取一些分段候选，按视频分组，每个视频只保留得分最高的分段及其时间点
+        results = bundle.index.search_batch(
+            self._segment_collection_name, query_vectors, top_k * SEGMENT_SEARCH_OVERSAMPLE, where=where,
+            fields=self._projection(fields, ['checksum', 'display_text', 'start', 'end']),
+        )
+        grouped = []
+        for hits in results:
+            best = {}
+            for hit in hits:
+                checksum = hit.payload['checksum']
+                if checksum not in best:
+                    best[checksum] = hit
+            grouped.append([
+                {
+                    'text': hit.payload['display_text'],
+                    'metadata': {
+                        k: v for k, v in hit.payload.items() if k != 'segment_text'
+                    },
+                    'score': hit.score
+                } for hit in list(best.values())[:top_k]
+            ])
+        return grouped
+
     def persist(self):
-        # Qdrant已经自动持久化到磁盘,所以这里不需要额外操作
-        pass
+        # 两种后端每次写入都已持久化到磁盘；flat 索引在这里把入库期间追加的增量段合并为新的一代
+        self._bundle.index.flush()
+
+    def close(self):
+        # 释放 Qdrant 的目录锁或 flat 索引的写锁
+        self._bundle.index.close()
 
 
 # 使用示例
@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import time
+from typing import List, Optional
+
+# 保留的索引版本数（含当前版本），多出的旧版本在切换后删除
+INDEX_KEEP_VERSIONS = int(os.environ.get("INDEX_KEEP_VERSIONS", 3))
+CURRENT_FILE = "CURRENT"
+VERSION_FILE = "version.json"
+# 构建中的版本带有此标记，切换为当前版本时删除；构建失败的版本保留标记，下次构建时在其基础上继续
+BUILDING_FILE = "BUILDING"
+# 复制版本时跳过各后端的锁文件
+LOCK_FILES = (".lock", "write.lock")
+
+
+def version_sort_key(version: str) -> tuple:
+    # 版本名为 时间-序号（同一秒内创建多个版本时才有序号），序号按数值比较，兼容未补零的旧版本名
+    date, _, rest = version.partition("-")
+    stamp, _, suffix = rest.partition("-")
+    return date, stamp, int(suffix) if suffix.isdigit() else 0, version
+
+
+class IndexVersions:
+    # 每次重建都写入 root 下的一个新版本目录，完成后原子替换 CURRENT 指针；
+    # 正在服务的进程检测到指针变化后重新打开，旧版本保留用于回滚
+    def __init__(self, root: str):
+        self._root = root
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def root(self) -> str:
+        return self._root
+
+    def _pointer_path(self) -> str:
+        return os.path.join(self._root, CURRENT_FILE)
+
+    def pointer_stat(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self._pointer_path())
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def current(self) -> Optional[dict]:
+        # {"version": 版本名, "backend": 索引后端}
+        try:
+            with open(self._pointer_path(), "r", encoding="utf-8") as f:
+                pointer = json.load(f)
+        except FileNotFoundError:
+            return None
+        if not os.path.isdir(self.path(pointer["version"])):
+            return None
+        return pointer
+
+    def path(self, version: str) -> str:
+        return os.path.join(self._root, version)
+
+    def list(self) -> List[str]:
+        return sorted(
+            (
+                name for name in os.listdir(self._root)
+                if os.path.isdir(os.path.join(self._root, name)) and not name.endswith(".part")
+            ),
+            key=version_sort_key,
+        )
+
+    def backend(self, version: str) -> str:
+        with open(os.path.join(self.path(version), VERSION_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["backend"]
+
+    def create(self, backend: str, source: Optional[str] = None) -> str:
+        # 新建版本目录；给定 source 时复制已有索引（增量更新在副本上进行）
+        version = time.strftime("%Y%m%d-%H%M%S")
+        suffix = 0
+        while os.path.exists(self.path(version)):
+            suffix += 1
+            version = f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix:03d}"
+        if source is not None and os.path.isdir(source):
+            shutil.copytree(source, self.path(version), ignore=shutil.ignore_patterns(*LOCK_FILES, BUILDING_FILE))
+        else:
+            os.makedirs(self.path(version))
+        with open(os.path.join(self.path(version), VERSION_FILE), "w", encoding="utf-8") as f:
+            json.dump({"backend": backend, "created_at": time.time()}, f)
+        open(os.path.join(self.path(version), BUILDING_FILE), "w").close()
+        return version
+
+    def building(self, version: str) -> bool:
+        return os.path.exists(os.path.join(self.path(version), BUILDING_FILE))
+
+    def unfinished(self) -> List[str]:
+        # 已创建但从未切换为当前版本的构建，按创建时间排序
+        return [version for version in self.list() if self.building(version)]
+
+    def activate(self, version: str):
+        try:
+            os.remove(os.path.join(self.path(version), BUILDING_FILE))
+        except FileNotFoundError:
+            pass
+        pointer = {"version": version, "backend": self.backend(version), "activated_at": time.time()}
+        temp_path = f"{self._pointer_path()}.part"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(pointer, f)
+        os.replace(temp_path, self._pointer_path())
+
+    def discard(self, version: str):
+        shutil.rmtree(self.path(version), ignore_errors=True)
+
+    def previous(self) -> Optional[str]:
+        current = self.current()
+        versions = [version for version in self.list() if not self.building(version)]
+        if current is None or current["version"] not in versions:
+            return None
+        index = versions.index(current["version"])
+        return versions[index - 1] if index > 0 else None
+
+    def prune(self, keep: int = INDEX_KEEP_VERSIONS):
+        # 只删除比当前版本旧的版本，回滚后较新的版本不受影响
+        current = self.current()
+        versions = self.list()
+        if current is None or current["version"] not in versions:
+            return
+        older = versions[:versions.index(current["version"])]
+        for version in older[:max(0, len(older) - (keep - 1))]:
+            # 仍被其他进程打开的文件在 Windows 下无法删除，下次再清理
+            shutil.rmtree(self.path(version), ignore_errors=True)
@@ -9,8 +9,9 @@ import argparse
 import os
 
 from main.interface import (
-    search_videos_by_keywords,
-    get_keywords_from_image,
+    asearch_videos_by_keywords,
+    aget_keywords_from_image,
+    start_warm_up,
     MAX_VIDEO_COUNT,
 )
 
@@ -20,12 +21,37 @@ VIDEO_DIR = os.environ.get("VIDEO_DIR", "videos")
 WORKING_DIR = os.environ.get("WORKING_DIR", "data")
 
 DEFAULT_THRESHOLD = 0.45
-
-
-def search_videos(keywords, threshold):
+# 章节分面中表示不过滤的选项
+ALL_CHAPTERS = "全部章节"
+
+# 分段检索返回时间点后，在浏览器端把对应的播放器跳转到该位置
+SEEK_JS = """
+(starts) => {
+    (starts || []).forEach((start, i) => {
+        if (!start) return;
+        const seek = () => {
+            const video = document.querySelector(`#result-video-${i} video`);
+            if (!video) return false;
+            const apply = () => { video.currentTime = start; };
+            if (video.readyState >= 1) apply();
+            else video.addEventListener("loadedmetadata", apply, {once: true});
+            return true;
+        };
+        if (!seek()) setTimeout(seek, 500);
+    });
+}
+"""
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+async def search_videos(keywords, threshold):
     keywords = keywords.split(", ")
     try:
-        videos = search_videos_by_keywords(keywords, threshold)
+        videos = await asearch_videos_by_keywords(keywords, threshold)
     except Exception as e:
         print(e)
     results = []
@@ -38,13 +64,35 @@ def search_videos(keywords, threshold):
             else:
                 print(".mov文件无法在Gradio页面中直接播放，建议使用.mp4格式")
         description = video['metadata']['display_text']
+        chapter = video['metadata'].get('chapter')
+        if chapter:
+            description += f"\n\n*章节: {chapter}*"
+        start = video['metadata'].get('start')
+        if start is not None:
+            description += f"\n\n*相关片段: {format_timestamp(start)} - {format_timestamp(video['metadata']['end'])}*"
         description += f"\n\n*相关度: {video['score']:.2f}*"
         print(video_path)
         print(description)
-        results.append((video_path, description))
+        results.append((video_path, description, start, chapter))
     return results
 
 
+def chapter_choices(results):
+    # 按结果中首次出现的顺序列出章节及视频数
+    counts = {}
+    for *_, chapter in results:
+        if chapter:
+            counts[chapter] = counts.get(chapter, 0) + 1
+    return [ALL_CHAPTERS] + [f"{chapter} ({count})" for chapter, count in counts.items()]
+
+
+def filter_by_chapter(results, choice):
+    if not choice or choice == ALL_CHAPTERS:
+        return results
+    chapter = choice.rsplit(" (", 1)[0]
+    return [result for result in results if result[3] == chapter]
+
+
 def create_demo():
     with gr.Blocks() as demo:
         with gr.Row():
@@ -60,22 +108,24 @@ def create_demo():
                 visible=False,
                 show_label=True,
             )
+        with gr.Row():
+            chapter_facet = gr.Radio(choices=[ALL_CHAPTERS], value=ALL_CHAPTERS, label="按章节筛选", visible=False)
 
         video_outputs = []
         for i in range(MAX_VIDEO_COUNT):  # 创建10个视频输出组件（隐藏）
             with gr.Row():
                 with gr.Column(scale=1):  # 视频占1/3宽度
-                    video = gr.Video(height=400, visible=False)
+                    video = gr.Video(height=400, visible=False, elem_id=f"result-video-{i}")
                 with gr.Column(scale=2):  # 描述占2/3宽度
                     description = gr.Markdown(visible=False)
             video_outputs.append((video, description))
+        seek_starts = gr.JSON(visible=False)
+        # 本次检索的全部结果，切换章节时在其中过滤，不重新检索
+        search_results = gr.State([])
 
-        def on_search(keywords, threshold):
-            if not keywords:
-                return [gr.update(value=None, visible=False) for _ in range(MAX_VIDEO_COUNT * 2)]
-            results = search_videos(keywords, threshold)
+        def render(results):
             outputs = []
-            for (video_path, desc), (video_comp, desc_comp) in zip(results, video_outputs):
+            for (video_path, desc, _, _), (video_comp, desc_comp) in zip(results, video_outputs):
                 outputs.extend([
                     gr.update(value=video_path, visible=True),
                     gr.update(value=desc, visible=True)
@@ -83,16 +133,28 @@ def create_demo():
             # 如果结果少于5个，隐藏多余的组件
             for _ in range(len(results), MAX_VIDEO_COUNT):
                 outputs.extend([gr.update(value=None, visible=False), gr.update(value="", visible=False)])
-            return outputs
+            return outputs + [[start for _, _, start, _ in results]]
+
+        async def on_search(keywords, threshold):
+            if not keywords:
+                return render([]) + [[], gr.update(choices=[ALL_CHAPTERS], value=ALL_CHAPTERS, visible=False)]
+            results = await search_videos(keywords, threshold)
+            choices = chapter_choices(results)
+            # 结果没有章节信息（未设置大纲）时不显示分面
+            facet = gr.update(choices=choices, value=ALL_CHAPTERS, visible=len(choices) > 1)
+            return render(results) + [results, facet]
+
+        def on_chapter(choice, results):
+            return render(filter_by_chapter(results, choice))
 
         def on_clear():
             return [None, gr.update(value=DEFAULT_THRESHOLD), gr.update(visible=False)] + [
                 gr.update(value=None, visible=False) for _ in range(MAX_VIDEO_COUNT * 2)
-            ]
+            ] + [[], gr.update(choices=[ALL_CHAPTERS], value=ALL_CHAPTERS, visible=False)]
 
-        def on_image_upload(image):
+        async def on_image_upload(image):
             if image is not None:
-                keywords = get_keywords_from_image(image)
+                keywords = await aget_keywords_from_image(image)
                 text = ", ".join(keywords)
                 return [
                     gr.update(interactive=True, variant="primary"),
@@ -113,14 +175,20 @@ def create_demo():
         search_btn.click(
             on_search,
             inputs=[keyword_frame, threshold_slider],
-            outputs=[comp for pair in video_outputs for comp in pair]
-        )
+            outputs=[comp for pair in video_outputs for comp in pair] + [seek_starts, search_results, chapter_facet]
+        ).then(None, inputs=[seek_starts], js=SEEK_JS)
 
         threshold_slider.release(
             on_search,
             inputs=[keyword_frame, threshold_slider],
-            outputs=[comp for pair in video_outputs for comp in pair]
-        )
+            outputs=[comp for pair in video_outputs for comp in pair] + [seek_starts, search_results, chapter_facet]
+        ).then(None, inputs=[seek_starts], js=SEEK_JS)
+
+        chapter_facet.input(
+            on_chapter,
+            inputs=[chapter_facet, search_results],
+            outputs=[comp for pair in video_outputs for comp in pair] + [seek_starts]
+        ).then(None, inputs=[seek_starts], js=SEEK_JS)
 
         clear_btn.click(
             on_clear,
@@ -128,7 +196,7 @@ def create_demo():
                         image_input,
                         threshold_slider,
                         keyword_frame
-                    ] + [comp for pair in video_outputs for comp in pair]
+                    ] + [comp for pair in video_outputs for comp in pair] + [search_results, chapter_facet]
         )
 
     return demo
@@ -139,6 +207,8 @@ def main():
     parser.add_argument("--port", type=int, default=8888, help="运行应用的端口号")
     args = parser.parse_args()
 
+    # 在后台加载大纲关键字的预计算结果，加载完成前照常检索
+    start_warm_up()
     demo = create_demo()
     data_dir = os.path.abspath(os.path.join(WORKING_DIR, VIDEO_DIR))
     demo.launch(server_name="0.0.0.0", server_port=args.port, allowed_paths=[data_dir], root_path="/video-search")